@@ -0,0 +1,231 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from data_manager import data_manager
+from disk_cache import PRODUCTS
+from ee import landsat
+from metrics import stats
+from osgeo import gdal
+from pathlib import Path
+
+FORMATS = {'png':'PNG', 'tif':'GTiff'} # output extension and gdal driver
+PRODUCT_BANDS = dict(PRODUCTS, anomaly=['B6','B7']) # products the batch renders and the bands they need
+REQUIRED = ['end','output_folder','start','working_folder'] # job settings without a default
+TIFF_OPTIONS = ['TILED=YES','COMPRESS=DEFLATE','BIGTIFF=IF_SAFER']
+
+#--------------------------------------------------------------------------------------------------
+#+
+# headless batch runs: query and download every job of a job file with ee.landsat, then render the
+# products of every scene found to GeoTIFF/PNG on a process pool. no display or Qt application is
+# needed. a job file looks like
+#
+# {"working_folder": "/data/landsat", "output_folder": "/data/products",
+#  "cloud_cover": 50, "products": ["rgb","methane"], "formats": ["tif","png"],
+#  "jobs": [{"name": "turkmenistan", "points": [[54.199,38.499]], "start": "2024-01-01", "end": "2024-03-31"},
+#           {"name": "permian", "boxes": [[-104.0,31.5,-103.0,32.5]], "start": "2024-06-01", "end": "2024-06-30"}]}
+#
+# values given at the top level are the defaults of every job. products that already exist are not
+# rendered again, so a nightly run only adds the new scenes.
+#-
+
+dm = None # the data manager of a render worker
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+def get_login(file_login=None):
+    file_login = os.path.join(Path.home(), 'methane_finder', 'ee_login.json') if \
+        (file_login == None) else file_login
+    if not os.path.exists(file_login):
+        return '', ''
+    with open(file_login, 'r') as file:
+        j = json.load(file)
+    return j.get('username', ''), j.get('token', '')
+
+#--------------------------------------------------------------------------------------------------
+#+
+# the path/row and date folder of a scene found by ee.landsat.query_batch (see is_valid_url)
+#-
+def get_scene_id(result):
+    tok = result['displayId'].split('_')
+    return tok[2], tok[3]
+
+#--------------------------------------------------------------------------------------------------
+#+
+# worker process initializer; each worker has a render-only data manager over the shared working
+# folder. the parent has scanned the folder, and a worker keeps nothing in memory between renders
+#-
+def init_worker(dir):
+    global dm
+    gdal.UseExceptions()
+    dm = data_manager(working_folder=dir, cache_bytes=0, n_workers=1, preview=False, scan=False)
+
+#--------------------------------------------------------------------------------------------------
+#+
+# raises ValueError for a job that could only fail part way through the run
+#-
+def check_job(job):
+    missing = [key for key in REQUIRED if not job.get(key)]
+    if (len(missing) > 0):
+        raise ValueError(f'job {job["name"]}: missing {", ".join(missing)}')
+    unknown = [p for p in job['products'] if (p.lower() not in PRODUCT_BANDS)]
+    if (len(unknown) > 0):
+        raise ValueError(f'job {job["name"]}: unknown products {", ".join(unknown)} '+
+                         f'(supported: {", ".join(sorted(PRODUCT_BANDS))})')
+    unknown = [fmt for fmt in job['formats'] if (fmt not in FORMATS)]
+    if (len(unknown) > 0):
+        raise ValueError(f'job {job["name"]}: unknown formats {", ".join(unknown)} '+
+                         f'(supported: {", ".join(sorted(FORMATS))})')
+    if not (job.get('points') or job.get('boxes')):
+        raise ValueError(f'job {job["name"]}: no points or boxes to search')
+
+#--------------------------------------------------------------------------------------------------
+#+
+# job settings with the file-level defaults filled in
+#-
+def load_job(file):
+    with open(file, 'r') as f:
+        d = json.load(f)
+    default = {key:value for key, value in d.items() if (key != 'jobs')}
+    default.setdefault('cloud_cover', 50.0)
+    default.setdefault('formats', ['tif'])
+    default.setdefault('products', ['rgb','methane'])
+    jobs = []
+    for i, job in enumerate(d.get('jobs', [])):
+        job = dict(default, **job)
+        job.setdefault('name', f'job{i}')
+        check_job(job)
+        jobs.append(job)
+    return jobs
+
+#--------------------------------------------------------------------------------------------------
+#+
+# renders one product of one scene (runs in a worker process) and returns the files written. the
+# disk cache is read but not written: the files written are the lasting copy of the product.
+#-
+def render(pr, dt, product, dirOut, formats):
+    file = {fmt:os.path.join(dirOut, f'{pr}_{dt}_{product.lower()}.{fmt}') for fmt in formats}
+    todo = [fmt for fmt in formats if not os.path.exists(file[fmt])]
+    if (len(todo) == 0):
+        return []
+    t0 = time.perf_counter()
+    dDT = dm.get_inputs(pr, dt, product)
+    npImg = dm.disk.get(dDT, product)
+    if (npImg is None):
+        npImg = dm.compute_product(dDT, product)
+    geo = dm.get_georef(pr, dt)
+    for fmt in todo:
+        write_image(npImg, file[fmt], FORMATS[fmt], geo)
+    stats.add(f'render {product.lower()}', time.perf_counter()-t0, n_bytes=npImg.nbytes)
+    return [file[fmt] for fmt in todo]
+
+#--------------------------------------------------------------------------------------------------
+#+
+# runs every job: query, download, then render. returns the files written.
+#-
+def run(jobs, download=True, file_login=None, log_file=None, n_workers=None, offline=False):
+    n_workers = os.cpu_count() if (n_workers == None) else n_workers
+    uname, token = get_login(file_login)
+    written = []
+    for job in jobs: # checked before anything is downloaded
+        check_job(job)
+    for job in jobs:
+        t0 = time.perf_counter()
+        product = [p.lower() for p in job['products']]
+        bands = job.get('bands') or sorted({b for p in product for b in PRODUCT_BANDS[p]})
+        api = landsat(uname, token, bands=bands, cloud_cover=job['cloud_cover'], log_file=log_file,
+                      offline=offline, working_folder=job['working_folder'])
+        print(f'{job["name"]}: {job["start"]} to {job["end"]}, products: {", ".join(product)}')
+        scene = api.query_batch(job['start'], job['end'], bands=bands, boxes=job.get('boxes'),
+                                points=job.get('points'))
+        if (scene == None):
+            print(f'{job["name"]}: query failed')
+            continue
+        if download:
+            api.download_all(use_threads=True, bands=bands)
+        if not offline:
+            api.logout()
+    # render what is on disk for the scenes found
+        dm_job = data_manager(working_folder=job['working_folder'], preview=False)
+        kScene = sorted({get_scene_id(result) for result in scene})
+    # a product is rendered for the dates that hold all of its bands (downloads may be partial)
+        kTask = [(pr, dt, p) for pr, dt in kScene for p in product
+                 if dt in dm_job.catalog.list_dt(pr, bands=PRODUCT_BANDS[p])]
+    # the anomaly product of every date reads one stack per path/row; build each once, here, rather
+    # than in every render worker at the same time
+        if 'anomaly' in product:
+            for pr in sorted({pr for pr, dt, p in kTask if (p == 'anomaly')}):
+                dm_job.stack_statistics(pr, n_workers=n_workers)
+        dm_job.catalog.close()
+        dirOut = os.path.join(job['output_folder'], job['name'])
+        os.makedirs(dirOut, exist_ok=True)
+        print(f'{job["name"]}: rendering {len(kTask)} products of {len(kScene)} scenes '+
+              f'on {n_workers} processes')
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_worker, initargs=(job['working_folder'],)) as pool:
+            future = {pool.submit(render, pr, dt, p, dirOut, job['formats']):(pr, dt, p)
+                      for pr, dt, p in kTask}
+            for f in as_completed(future):
+                pr, dt, p = future[f]
+                if (f.exception() != None):
+                    print(f' {pr} {dt} {p}: failed ({f.exception()})')
+                    continue
+                for file in f.result():
+                    print(f' {file}')
+                written += f.result()
+        print(f'{job["name"]}: done in {time.perf_counter()-t0:.0f} s')
+    return written
+
+#--------------------------------------------------------------------------------------------------
+#+
+# gdal writes the array through an in-memory dataset, so every output driver gets the same copy
+#-
+def write_image(npImg, file, driver, geo):
+    n = 1 if (npImg.ndim == 2) else npImg.shape[2]
+    dtype = gdal.GDT_Byte if (npImg.dtype.itemsize == 1) else gdal.GDT_UInt16
+    mem = gdal.GetDriverByName('MEM').Create('', npImg.shape[1], npImg.shape[0], n, dtype)
+    mem.SetGeoTransform(geo.gt.tolist())
+    mem.SetProjection(geo.wkt)
+    for i in range(n):
+        mem.GetRasterBand(i+1).WriteArray(npImg if (n == 1) else npImg[:,:,i])
+    tmp = f'{file}.tmp'
+    options = TIFF_OPTIONS if (driver == 'GTiff') else []
+    gdal.GetDriverByName(driver).CreateCopy(tmp, mem, options=options)
+    mem = None
+    os.replace(tmp, file)
+    if os.path.exists(tmp+'.aux.xml'): # the georeference of a png
+        os.replace(tmp+'.aux.xml', file+'.aux.xml')
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+def main(args):
+    jobs = load_job(args.job)
+    t0 = time.perf_counter()
+    written = run(jobs, download=not args.no_download, file_login=args.login_file, log_file=args.log_file,
+                  n_workers=args.n_workers, offline=args.offline)
+    print(f'{len(written)} files written in {time.perf_counter()-t0:.0f} s')
+    return written
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+def get_parser(parser=None):
+    parser = argparse.ArgumentParser(description='headless Landsat query, download and render') \
+        if (parser == None) else parser
+    parser.add_argument('job', type=str, help='job file (JSON)')
+    parser.add_argument('--log_file', type=str, default=None, help='rotating log file')
+    parser.add_argument('--login_file', type=str, default=None, help='EarthExplorer login (JSON)')
+    parser.add_argument('--n_workers', type=int, default=None, help='render processes (default: all cores)')
+    parser.add_argument('--no_download', action='store_true', help='render the scenes already on disk only')
+    parser.add_argument('--offline', action='store_true', help='answer queries from the response cache')
+    return parser
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+if (__name__ == '__main__'):
+    main(get_parser().parse_args())
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+GUI_MODULES = ['PyQt6','tkinter'] # must not be loaded by the cli and core paths
+HEAVY_MODULES = GUI_MODULES+['numpy','osgeo','requests']
+PATHS = {'cli':['m2m_client','catalog','download_manager','ee'], # query/download without processing
+         'core':['data_manager','batch'],                         # raster processing, headless runs
+         'gui':['landsat_viewer']}                                # imports only; no window is opened
+
+# run in a fresh interpreter so every import is cold
+SCRIPT = '''
+import json, sys, time
+t0 = time.perf_counter()
+try:
+    __import__(sys.argv[1])
+    error = None
+except Exception as e:
+    error = f'{e.__class__.__name__}: {e}'
+t = time.perf_counter()-t0
+print(json.dumps({'error':error, 'loaded':[m for m in sys.argv[2:] if m in sys.modules], 'time':t}))
+'''
+
+#--------------------------------------------------------------------------------------------------
+#+
+# cold-start import time of the module (median of n fresh interpreters), the whole process time
+# including interpreter start-up, and which heavy modules the import pulled in
+#-
+def time_import(module, n=5):
+    dir = os.path.dirname(os.path.abspath(__file__))
+    t, t_process, d = [], [], None
+    for i in range(n):
+        t0 = time.perf_counter()
+        r = subprocess.run([sys.executable, '-c', SCRIPT, module]+HEAVY_MODULES, capture_output=True,
+                           cwd=dir, text=True)
+        t_process.append(time.perf_counter()-t0)
+        d = json.loads(r.stdout.strip().splitlines()[-1])
+        if (d['error'] != None):
+            break
+        t.append(d['time'])
+    return {'error':d['error'], 'loaded':d['loaded'], 'module':module,
+            'process':statistics.median(t_process), 'time':statistics.median(t) if t else None}
+
+#--------------------------------------------------------------------------------------------------
+#+
+# the n slowest imports of the module by cumulative time, from python -X importtime
+#-
+def top_imports(module, n=15):
+    dir = os.path.dirname(os.path.abspath(__file__))
+    r = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True,
+                       cwd=dir, text=True)
+    row = []
+    for line in r.stderr.splitlines():
+        tok = line.split('|')
+        if (len(tok) == 3) and tok[1].strip().isdigit():
+            row.append((int(tok[1]), tok[2].rstrip()))
+    return sorted(row, reverse=True)[:n]
+
+#--------------------------------------------------------------------------------------------------
+#+
+# times every path and flags a cli/core import that loads a gui toolkit. returns the results.
+#-
+def bench_import(n=5, paths=None, file=None, top=0):
+    result = []
+    for path in (PATHS if (paths == None) else paths):
+        for module in PATHS[path]:
+            d = time_import(module, n=n)
+            d['path'] = path
+            d['gui_leak'] = (path != 'gui') and any(m in d['loaded'] for m in GUI_MODULES)
+            result.append(d)
+            if (d['error'] != None):
+                print(f'{path:>5} {module:<18} failed ({d["error"]})')
+                continue
+            flag = '  <- loads a gui toolkit' if d['gui_leak'] else ''
+            print(f'{path:>5} {module:<18} {1000*d["time"]:>8.1f} ms import {1000*d["process"]:>8.1f} ms process'+
+                  f'  [{", ".join(d["loaded"])}]{flag}')
+            for us, name in top_imports(module, n=top):
+                print(f'{"":>25}{us/1000:>8.1f} ms {name}')
+    if (file != None):
+        with open(file, 'w') as f:
+            json.dump(result, f, indent=2)
+    return result
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+if (__name__ == '__main__'):
+    parser = argparse.ArgumentParser(description='cold-start import times of the cli, core and gui paths')
+    parser.add_argument('--file', type=str, default=None, help='save the results (JSON) to compare runs')
+    parser.add_argument('--n', type=int, default=5, help='fresh interpreters per module')
+    parser.add_argument('--path', type=str, nargs='*', default=None, choices=list(PATHS))
+    parser.add_argument('--top', type=int, default=0, help='also list the slowest imports of each module')
+    args = parser.parse_args()
+    result = bench_import(n=args.n, paths=args.path, file=args.file, top=args.top)
+    # a module that fails to import fails the run as much as one that loads a gui toolkit
+    sys.exit(1 if any(d['gui_leak'] or (d['error'] != None) for d in result) else 0)
@@ -0,0 +1,239 @@
+import os
+import re
+import sqlite3
+import threading
+
+#--------------------------------------------------------------------------------------------------
+#+
+# sqlite catalog of the scenes in a working folder (<path/row>/<date>/*_B<n>.TIF). scenes are only
+# re-read when their folder's modification time changes, so an update over an unchanged folder is
+# a stat per date folder. the gui lists and band lookups are indexed queries.
+#-
+class catalog():
+
+    file = 'catalog.sqlite'
+    rex_band = re.compile(r'_B(\d+)\.tif$', re.IGNORECASE)
+    rex_cloud = re.compile(r'^\s*CLOUD_COVER\s*=\s*"?([-\d.]+)', re.MULTILINE)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __init__(self, folder):
+        self.dir = folder
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(folder, self.file), check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS scene (pr TEXT, dt TEXT, dir TEXT, mtime REAL, acquired TEXT,
+                cloud_cover REAL, lon_min REAL, lat_min REAL, lon_max REAL, lat_max REAL,
+                PRIMARY KEY (pr, dt));
+            CREATE TABLE IF NOT EXISTS band (pr TEXT, dt TEXT, band TEXT, path TEXT, size INTEGER,
+                mtime REAL, PRIMARY KEY (pr, dt, band));
+            CREATE TABLE IF NOT EXISTS fit (pr TEXT, dt TEXT, slope REAL, intercept REAL, n_sample INTEGER,
+                PRIMARY KEY (pr, dt));
+            CREATE INDEX IF NOT EXISTS scene_acquired ON scene (pr, acquired);''')
+        self.db.commit()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __str__(self):
+        n = self.query('SELECT COUNT(*) FROM scene')[0][0]
+        return f'catalog: {os.path.join(self.dir, self.file)} ({n} scenes)'
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # footprint of the band in lon/lat, as (lon_min, lat_min, lon_max, lat_max)
+    #-
+    def get_footprint(self, file):
+        from osgeo import gdal, osr
+        raster = gdal.Open(file)
+        if (raster == None):
+            return None
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(raster.GetProjection())
+        wgs84 = osr.SpatialReference()
+        wgs84.SetWellKnownGeogCS("WGS84")
+        wgs84.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        tf = osr.CoordinateTransformation(srs, wgs84)
+        x0, a, b, y0, d, e = raster.GetGeoTransform()
+        nx, ny = raster.RasterXSize, raster.RasterYSize
+        corner = [tf.TransformPoint(x0+a*i+b*j, y0+d*i+e*j)[:2] for i, j in [(0,0),(nx,0),(0,ny),(nx,ny)]]
+        lon, lat = [c[0] for c in corner], [c[1] for c in corner]
+        return min(lon), min(lat), max(lon), max(lat)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # {band: path, 'date': 'yyyy/mm/dd'} for the scene (the layout data_manager works with)
+    #-
+    def get_scene(self, pr, dt):
+        dDT = {band:path for band, path in
+               self.query('SELECT band, path FROM band WHERE pr=? AND dt=?', (pr, dt))}
+        dDT['date'] = f'{dt[0:4]}/{dt[4:6]}/{dt[6:]}'
+        return dDT
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # stored B6/B7 methane fit [slope, intercept] of the scene, or None
+    #-
+    def get_fit(self, pr, dt):
+        row = self.query('SELECT slope, intercept FROM fit WHERE pr=? AND dt=?', (pr, dt))
+        return list(row[0]) if (len(row) > 0) else None
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_scene_info(self, pr, dt):
+        row = self.query('SELECT dir, acquired, cloud_cover, lon_min, lat_min, lon_max, lat_max '+
+                         'FROM scene WHERE pr=? AND dt=?', (pr, dt))
+        if (len(row) == 0):
+            return None
+        k = ['dir','acquired','cloud_cover','lon_min','lat_min','lon_max','lat_max']
+        d = dict(zip(k, row[0]))
+        d['bands'] = {band:{'path':path, 'size':size} for band, path, size in
+                      self.query('SELECT band, path, size FROM band WHERE pr=? AND dt=?', (pr, dt))}
+        return d
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # dates of the path/row; with bands, only the dates that hold every one of them (a date folder
+    # may hold some bands only, from a band-selective or an unfinished download)
+    #-
+    def list_dt(self, pr, bands=None):
+        if not bands:
+            return [r[0] for r in self.query('SELECT dt FROM scene WHERE pr=? ORDER BY acquired, dt', (pr,))]
+        bands = sorted(set(bands))
+        return [r[0] for r in self.query('SELECT dt FROM scene WHERE pr=? AND (SELECT COUNT(*) FROM band '+
+                                         'WHERE band.pr=scene.pr AND band.dt=scene.dt AND band.band IN '+
+                                         f'({",".join("?"*len(bands))}))=? ORDER BY acquired, dt',
+                                         [pr]+bands+[len(bands)])]
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def list_pr(self):
+        return [r[0] for r in self.query('SELECT DISTINCT pr FROM scene ORDER BY pr')]
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def query(self, sql, args=()):
+        with self.lock:
+            return self.db.execute(sql, args).fetchall()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # reads the cloud cover from the scene's MTL file when it was kept
+    #-
+    def read_cloud_cover(self, dirDT, base):
+        for file in base:
+            if file.upper().endswith('_MTL.TXT'):
+                with open(os.path.join(dirDT, file), 'r') as f:
+                    m = self.rex_cloud.search(f.read())
+                return float(m.group(1)) if m else None
+        return None
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def remove_scene(self, pr, dt):
+        with self.lock:
+            for table in ['band','fit','scene']:
+                self.db.execute(f'DELETE FROM {table} WHERE pr=? AND dt=?', (pr, dt))
+            self.db.commit()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def set_fit(self, pr, dt, c, n_sample=None):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO fit VALUES (?,?,?,?,?)',
+                            (pr, dt, float(c[0]), float(c[1]), n_sample))
+            self.db.commit()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # scene metadata known from elsewhere (e.g. the M2M search), such as cloud_cover
+    #-
+    def set_metadata(self, pr, dt, **kwargs):
+        k = [key for key in kwargs if key in ['acquired','cloud_cover','lon_min','lat_min','lon_max','lat_max']]
+        if (len(k) == 0):
+            return None
+        with self.lock:
+            self.db.execute(f'UPDATE scene SET {", ".join(key+"=?" for key in k)} WHERE pr=? AND dt=?',
+                            [kwargs[key] for key in k]+[pr, dt])
+            self.db.commit()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # incremental update: returns the (pr, dt) of the scenes that were added, changed or removed
+    #-
+    def update(self):
+        known = {(pr, dt):mtime for pr, dt, mtime in self.query('SELECT pr, dt, mtime FROM scene')}
+        seen, changed = set(), []
+        for entryPR in os.scandir(self.dir):
+            if not entryPR.is_dir():
+                continue
+            for entryDT in os.scandir(entryPR.path):
+                if not entryDT.is_dir():
+                    continue
+                key = (entryPR.name, entryDT.name)
+                seen.add(key)
+                if (known.get(key) != entryDT.stat().st_mtime):
+                    if self.update_scene(entryPR.name, entryDT.name) or (key in known):
+                        changed.append(key)
+        for key in set(known)-seen:
+            self.remove_scene(*key)
+            changed.append(key)
+        return changed
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # (re)reads one date folder and returns whether it is listed (folders without bands are not)
+    #-
+    def update_scene(self, pr, dt):
+        dirDT = os.path.join(self.dir, pr, dt)
+        if not os.path.isdir(dirDT):
+            self.remove_scene(pr, dt)
+            return False
+        mtime = os.stat(dirDT).st_mtime
+        base = os.listdir(dirDT)
+        band = []
+        for file in base:
+            m = self.rex_band.search(file)
+            if (m != None):
+                st = os.stat(os.path.join(dirDT, file))
+                band.append((pr, dt, f'B{int(m.group(1))}', os.path.join(dirDT, file), st.st_size, st.st_mtime))
+        old = self.query('SELECT lon_min, lat_min, lon_max, lat_max FROM scene WHERE pr=? AND dt=?', (pr, dt))
+        footprint = old[0] if (len(old) > 0) and (old[0][0] != None) else None
+        if (footprint == None) and (len(band) > 0):
+            try:
+                footprint = self.get_footprint(band[0][3])
+            except Exception: # a band that is still being written
+                footprint = None
+        footprint = (None,)*4 if (footprint == None) else footprint
+        acquired = f'{dt[0:4]}-{dt[4:6]}-{dt[6:8]}'
+        cloud_cover = self.read_cloud_cover(dirDT, base)
+        with self.lock:
+            self.db.execute('DELETE FROM band WHERE pr=? AND dt=?', (pr, dt))
+            self.db.execute('DELETE FROM fit WHERE pr=? AND dt=?', (pr, dt))
+            if (len(band) == 0):
+                self.db.execute('DELETE FROM scene WHERE pr=? AND dt=?', (pr, dt))
+            else:
+                self.db.execute('INSERT INTO scene (pr, dt, dir, mtime, acquired, cloud_cover, lon_min, '+
+                                'lat_min, lon_max, lat_max) VALUES (?,?,?,?,?,?,?,?,?,?) ON CONFLICT (pr, dt) '+
+                                'DO UPDATE SET dir=excluded.dir, mtime=excluded.mtime, '+
+                                'cloud_cover=COALESCE(excluded.cloud_cover, scene.cloud_cover), '+
+                                'lon_min=excluded.lon_min, lat_min=excluded.lat_min, '+
+                                'lon_max=excluded.lon_max, lat_max=excluded.lat_max',
+                                (pr, dt, dirDT, mtime, acquired, cloud_cover)+tuple(footprint))
+                self.db.executemany('INSERT INTO band VALUES (?,?,?,?,?,?)', band)
+            self.db.commit()
+        return len(band) > 0
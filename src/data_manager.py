@@ -1,27 +1,219 @@
+import glob
+import hashlib
+import multiprocessing
 import numpy as np
 import os
 import re
 import tempfile
+import threading
+import time
+import tracemalloc
+import warnings
 
+from catalog import catalog
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from disk_cache import PRODUCTS, disk_cache
+from metrics import stats
 from osgeo import gdal, osr
-from PyQt6 import QtCore, QtGui, QtWidgets
+from product_cache import product_cache
+
+RESAMPLE = {'average':gdal.GRIORA_Average, 'bilinear':gdal.GRIORA_Bilinear,
+            'nearest':gdal.GRIORA_NearestNeighbour}
+BLOCK_ROWS = 512 # rows read per block by the streaming band readers
+METHANE_BYTES = 64*2**20 # working memory ceiling of the streaming methane engine
+METHANE_PIXEL_BYTES = 48 # bytes of temporaries per pixel of a B6/B7 block
+N_DRILL = 8 # threads of the pixel-drill reads (small reads are latency bound)
+PREVIEW_SAMPLE = 2**18 # pixels in the sampled methane fit
+PREVIEW_SIZE = 1024 # longest side of the methane preview
+SOURCE_BYTES = 32*2**20 # product cache charge of an open single-band source (dataset and block cache)
+STACK_BANDS = ['mean','std','median','mad','z_max','n'] # bands of the stack statistics product
+STACK_BYTES = 1024**3 # working memory ceiling of the stack statistics engine, over all workers
+STACK_PIXEL_BYTES = 20 # bytes per pixel and date of a stack chunk (residual and its temporaries)
+TRIM_SIZE = 7991 # scenes of this size lose their first column (and row) on read
+Z_STRETCH = 5.0 # robust z shown as full scale by the anomaly product
+
+# windowed, decimated view of a single band, read on demand (see data_view.array_source)
+class raster_source():
+
+    def __init__(self, dm, file):
+        self.dm = dm
+        self.raster = gdal.Open(file)
+        self.nbytes = SOURCE_BYTES
+        self.shape = dm.get_size(self.raster)
+
+    def read(self, x0, y0, x1, y1, step=1):
+        nx, ny = -(-(x1-x0)//step), -(-(y1-y0)//step)
+        return self.dm.read_window(self.raster, xoff=x0, yoff=y0, xsize=x1-x0, ysize=y1-y0,
+                                   buf_xsize=nx, buf_ysize=ny)
+
+# geotransform and projection<->wgs84 transformers of one scene, built once and reused. pixel
+# coordinates are in the trimmed grid the viewer shows; all conversions take scalars or arrays.
+class georef():
+
+    def __init__(self, dm, file, trim=True):
+        raster = gdal.Open(file) if isinstance(file, str) else file
+        x0, y0 = dm.get_trim(raster) if trim else (0, 0)
+        gt = raster.GetGeoTransform()
+    # fold the trim offset into the origin so pixel (0,0) is the first pixel shown
+        self.gt = np.array([gt[0]+gt[1]*x0+gt[2]*y0, gt[1], gt[2], gt[3]+gt[4]*x0+gt[5]*y0, gt[4], gt[5]])
+        det = self.gt[1]*self.gt[5]-self.gt[2]*self.gt[4]
+        self.inv = np.array([[self.gt[5], -self.gt[2]], [-self.gt[4], self.gt[1]]])/det
+        self.wkt = raster.GetProjection()
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(self.wkt)
+        wgs84 = osr.SpatialReference()
+        wgs84.SetWellKnownGeogCS('WGS84')
+    # keep lon/lat order regardless of the gdal 3 authority axis order
+        for sr in [srs, wgs84]:
+            sr.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        self.to_lonlat = osr.CoordinateTransformation(srs, wgs84)
+        self.to_map = osr.CoordinateTransformation(wgs84, srs)
+
+    def lonlat_to_map(self, lon, lat):
+        return self.transform(self.to_map, lon, lat)
+
+    def lonlat_to_pixel(self, lon, lat):
+        return self.map_to_pixel(*self.lonlat_to_map(lon, lat))
+
+    def map_to_lonlat(self, x_map, y_map):
+        return self.transform(self.to_lonlat, x_map, y_map)
+
+    def map_to_pixel(self, x_map, y_map):
+        dx, dy = np.asarray(x_map, dtype=np.float64)-self.gt[0], np.asarray(y_map, dtype=np.float64)-self.gt[3]
+        return self.inv[0,0]*dx+self.inv[0,1]*dy, self.inv[1,0]*dx+self.inv[1,1]*dy
+
+    def pixel_to_lonlat(self, x, y):
+        return self.map_to_lonlat(*self.pixel_to_map(x, y))
+
+    def pixel_to_map(self, x, y):
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        return self.gt[0]+self.gt[1]*x+self.gt[2]*y, self.gt[3]+self.gt[4]*x+self.gt[5]*y
+
+    def transform(self, tf, x, y):
+    # one call for the whole array; a single point skips the array round trip
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        if (x.ndim == 0) and (y.ndim == 0):
+            return tf.TransformPoint(float(x), float(y))[:2]
+        x, y = np.broadcast_arrays(x, y)
+        xy = np.array(tf.TransformPoints(np.column_stack([x.ravel(), y.ravel()])))
+        return xy[:,0].reshape(x.shape), xy[:,1].reshape(x.shape)
+
+# low-resolution image presented at the full scene size it was decimated from
+class preview_source():
+
+    def __init__(self, data, shape):
+        self.data = data
+        self.shape = shape
+
+    def read(self, x0, y0, x1, y1, step=1):
+        ys = (np.arange(y0, y1, step)*self.data.shape[0]//self.shape[0])
+        xs = (np.arange(x0, x1, step)*self.data.shape[1]//self.shape[1])
+        return self.data[np.ix_(ys, xs)]
+
+def get_bands(product):
+# source bands of a product; a date is listed for the product only when it holds all of them
+    product = product.lower()
+    if product in ['anomaly','methane preview']:
+        return PRODUCTS['methane']
+    return PRODUCTS.get(product, [product.upper()])
+
+def get_trim(raster):
+# offset of the trimmed grid within the raster (the first column/row of 7991-pixel scenes)
+    x0 = 1 if (raster.RasterYSize == TRIM_SIZE) else 0
+    y0 = 1 if ((raster.RasterXSize-x0) == TRIM_SIZE) else 0
+    return x0, y0
+
+def read_padded(file, xoff, yoff, xsize, ysize, band=1, fill=0, trim=True):
+# float32 window of the (trimmed) band; pixels outside the band, or equal to fill, are NaN
+    raster = gdal.Open(file) if isinstance(file, str) else file
+    x0, y0 = get_trim(raster) if trim else (0, 0)
+    ny, nx = raster.RasterYSize-y0, raster.RasterXSize-x0
+    out = np.full((ysize, xsize), np.nan, dtype=np.float32)
+    xa, ya = max(0, xoff), max(0, yoff)
+    xb, yb = min(nx, xoff+xsize), min(ny, yoff+ysize)
+    if (xb > xa) and (yb > ya):
+        data = raster.GetRasterBand(band).ReadAsArray(xa+x0, ya+y0, xb-xa, yb-ya).astype(np.float32)
+        if (fill != None):
+            data[data == fill] = np.nan
+        out[ya-yoff:yb-yoff, xa-xoff:xb-xoff] = data
+    return out
+
+def get_tiles(nx, ny, block, pixels):
+# (x0, y0, xsize, ysize) tiles covering the grid, made of whole source blocks and as square as a
+# budget of pixels per tile allows; a budget below one block gives block-wide strips instead
+    bx, by = block
+    nb = pixels//(bx*by)
+    if (nb > 0):
+        tx = min(max(1, int(np.sqrt(nb)))*bx, nx)
+        ty = min((pixels//(tx*by))*by, ny)
+    else:
+        tx, ty = min(bx, nx), max(1, min(ny, pixels//bx))
+    return [(x0, y0, min(tx, nx-x0), min(ty, ny-y0)) for y0 in range(0, ny, ty) for x0 in range(0, nx, tx)]
+
+stack_files = [] # the B6/B7 datasets of every date, opened once per stack worker process
+
+def init_stack_worker(files):
+    global stack_files
+    gdal.UseExceptions()
+    stack_files = [(gdal.Open(f6), gdal.Open(f7)) for f6, f7 in files]
+
+def stack_block(fits, offsets, x0, y0, xsize, ysize):
+# per-pixel statistics over the dates of the B6/B7 residual for a tile of the stack grid (runs in a
+# stack worker process). offsets[i] is the stack pixel of date i's pixel (0,0).
+    stack = np.empty((len(stack_files), ysize, xsize), dtype=np.float32)
+    for i, ((r6, r7), c, (ox, oy)) in enumerate(zip(stack_files, fits, offsets)):
+        stack[i] = read_padded(r6, x0-ox, y0-oy, xsize, ysize)
+        stack[i] *= np.float32(c[0])
+        stack[i] += np.float32(c[1])
+        stack[i] -= read_padded(r7, x0-ox, y0-oy, xsize, ysize)
+    with warnings.catch_warnings(): # pixels with no valid date are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(stack, axis=0)
+        std = np.nanstd(stack, axis=0)
+        median = np.nanmedian(stack, axis=0)
+        stack -= median
+        z_max = np.nanmax(stack, axis=0)
+        np.abs(stack, out=stack)
+        mad = np.nanmedian(stack, axis=0)
+        z_max /= np.float32(1.4826)*mad
+        n = np.sum(np.isfinite(stack), axis=0, dtype=np.float32)
+    return x0, y0, np.stack([mean, std, median, mad, z_max, n])
 
 class data_manager():
 
     _pr = None
-    d = {}
+    combo_box = None
     listPR = None
+    geo = None
     listDT = None
     listener = []
-    raster = None
 
-    def __init__(self, working_folder=None):
+    def __init__(self, working_folder=None, cache_bytes=2*1024**3, disk_bytes=20*1024**3, n_prefetch=1,
+                 n_workers=2, preview=True, scan=True):
+        self.cache = product_cache(max_bytes=cache_bytes)
+        self.inflight = {}
+        self.io_pool = ThreadPoolExecutor(max_workers=3, thread_name_prefix='band')
+        self.deliver_lock = threading.Lock()
+        self.disk_bytes = disk_bytes
+        self.drill_pool = ThreadPoolExecutor(max_workers=N_DRILL, thread_name_prefix='drill')
+        self.drill_request = None
+        self.drill_runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix='drill request')
+        self.georefs = {}
+        self.stack_jobs = {}
+        self.stack_lock = threading.Lock()
+        self.stack_runner = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stack')
+        self.lock = threading.Lock()
+        self.n_prefetch = n_prefetch
+        self.pool = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix='decode')
+        self.preview = preview
+        self.request = None
         self.dir = os.path.join(tempfile.gettempdir(),'data') if (working_folder == None) else working_folder
         if not os.path.exists(self.dir):
             os.mkdir(self.dir)
-        self.srs_wgs84 = osr.SpatialReference()
-        self.srs_wgs84.SetWellKnownGeogCS("WGS84")
-        self.parse()
+        self.catalog = catalog(self.dir)
+        self.disk = disk_cache(self.dir, max_bytes=disk_bytes)
+        if scan: # off for render workers, whose parent has brought the catalog up to date
+            self.parse()
         return None
 
     def __str__(self):
@@ -30,6 +222,121 @@ class data_manager():
     def add_listener(self, listener):
         self.listener.append(listener)
 
+    def add_scene(self, folder):
+    # applies one new or changed <path/row>/<date> folder to the catalog and lists, keeping the selection
+        dirPR, dt = os.path.split(os.path.normpath(folder))
+        pr = os.path.basename(dirPR)
+        if self.catalog.update_scene(pr, dt):
+            print(f'added scene: {pr} {dt}')
+        self.update_list()
+
+    def build_cache(self, pr, products=['rgb','methane']):
+    # eagerly writes the derived products of every date of the path/row to the disk cache
+        def build(dDT, product):
+            if not self.disk.has(dDT, product):
+                self.disk.put(dDT, product, self.compute_product(dDT, product))
+        return [self.pool.submit(build, self.get_inputs(pr, dt, product), product) for product in products
+                for dt in self.catalog.list_dt(pr, bands=get_bands(product))]
+
+    def build_stack(self, pr, cancel=None, max_bytes=STACK_BYTES, n_workers=None, progress=None):
+    # see stack_statistics, which serializes the calls
+        file = self.get_stack_file(pr)
+        if os.path.exists(file):
+            return file
+        kDT = [dt for dt in self.catalog.list_dt(pr) if {'B6','B7'} <= set(self.get_scene(pr, dt))]
+        if (len(kDT) == 0):
+            return None
+        n_workers = os.cpu_count() if (n_workers == None) else n_workers
+        files = [(self.get_scene(pr, dt)['B6'], self.get_scene(pr, dt)['B7']) for dt in kDT]
+        fits = [c.tolist() for c in self.drill_pool.map(lambda dt: self.get_fit(pr, dt), kDT)]
+        geo = self.get_georef(pr, kDT[0])
+        offsets = [self.get_offset(self.get_georef(pr, dt), geo) for dt in kDT]
+        ny, nx = self.get_size(files[0][0])
+    # tiles are whole blocks of the (tiled) sources, so no block is decoded twice; fewer workers are
+    # used when the budget cannot give each of them a block of every date
+        block_size = gdal.Open(files[0][0]).GetRasterBand(1).GetBlockSize()
+        pixel_bytes = len(kDT)*STACK_PIXEL_BYTES
+        n_workers = max(1, min(n_workers, max_bytes//(pixel_bytes*block_size[0]*block_size[1])))
+        tiles = get_tiles(nx, ny, block_size, max_bytes//(n_workers*pixel_bytes))
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        out = gdal.GetDriverByName('GTiff').Create(tmp, nx, ny, len(STACK_BANDS), gdal.GDT_Float32,
+                                                   options=['TILED=YES','COMPRESS=DEFLATE','BIGTIFF=IF_SAFER'])
+        out.SetGeoTransform(geo.gt.tolist())
+        out.SetProjection(geo.wkt)
+        for i, name in enumerate(STACK_BANDS):
+            out.GetRasterBand(i+1).SetDescription(name)
+            out.GetRasterBand(i+1).SetNoDataValue(np.nan)
+        print(f'stack statistics: {pr}, {len(kDT)} dates, {len(tiles)} tiles of {tiles[0][2]}x{tiles[0][3]} '+
+              f'on {n_workers} processes')
+    # each worker opens the datasets once. at most two tiles per worker are in flight, so finished
+    # results never pile up, and a cancel drops the tiles not started
+        n_done = 0
+        if (progress != None):
+            progress(n_done, len(tiles))
+        try:
+            with stats.timer('stack statistics', n_bytes=2*len(kDT)*nx*ny*2), \
+                 ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=init_stack_worker, initargs=(files,)) as pool:
+                pending = set()
+                for tile in tiles+[None]:
+                    if (cancel != None) and cancel.is_set():
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        raise CancelledError('cancelled')
+                    while pending and ((tile == None) or (len(pending) >= 2*n_workers)):
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            xb, yb, block = future.result()
+                            for i in range(len(STACK_BANDS)):
+                                out.GetRasterBand(i+1).WriteArray(block[i], xb, yb)
+                            n_done += 1
+                            if (progress != None):
+                                progress(n_done, len(tiles))
+                    if (tile != None):
+                        pending.add(pool.submit(stack_block, fits, offsets, *tile))
+            out.FlushCache()
+            out = None
+            os.replace(tmp, file)
+        except BaseException:
+            out = None
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+    # the stack of the previous set of dates is stale now
+        for stale in glob.glob(os.path.join(os.path.dirname(file), 'stack_*.tif')):
+            if (stale != file) and not self.disk.remove(stale):
+                print(f'stale stack statistics still open, left for a later build: {stale}')
+        return file
+
+    def cancel_stack(self):
+    # stops the stack jobs; a running one removes its partial file
+        with self.lock:
+            jobs = list(self.stack_jobs.values())
+            self.stack_jobs.clear()
+        for future, cancel in jobs: # outside the lock, as cancel runs the done callbacks
+            cancel.set()
+            future.cancel()
+
+    def cancel(self):
+    # drop every queued decode; a decode that already started still finishes into the cache
+        with self.lock:
+            for future in self.inflight.values():
+                future.cancel()
+            self.request = None
+
+    def compute_product(self, dDT, product):
+        match product.lower():
+            case 'anomaly':
+                return self.methane_anomaly(dDT)
+            case 'methane':
+                return self.methane_image(dDT)
+            case 'methane preview':
+                return self.methane_preview(dDT)
+            case 'rgb':
+                return self.rgb_image(dDT)
+            case _:
+                return self.open_file(dDT[product])
+
     def format_date(self, s):
         sOut = s[0:4]+'/'+s[4:6]+'/'+s[6:]
         return sOut
@@ -52,60 +359,124 @@ class data_manager():
         if not void:
             print('either path/row or date not selected selected')
             return None
-        dDT = (self.d[pr])[dt]
-        match self.combo_box.currentText().lower():
-            case 'methane':
-                if ("methane" in dDT):
-                    methane = dDT["methane"]
-                else:
-                    methane = self.methane_image(dDT)
-                    dDT["methane"] = methane
-                img = QtGui.QImage(methane.data, methane.shape[1], methane.shape[0], QtGui.QImage.Format.Format_Grayscale16)
-            case 'rgb':
-                band = ['B4','B3','B2']
-                if ("rgb" in dDT):
-                    rgb = dDT["rgb"]
-                else:
-                    npByte = []
-                    for key in band:
-                        npUint = self.open_file(dDT[key])
-                        npByte.append((npUint/256).astype(np.uint8))
-                        npUint = None
-                    rgb = np.zeros((npByte[0].shape[0], npByte[0].shape[1], len(band)), dtype=np.uint8)
-                    for i in range(len(band)):
-                        rgb[:,:,i] = npByte[i].data
-                    dDT["rgb"] = rgb
-                    for i in range(len(band)):
-                        npByte[i] = None
-                img = QtGui.QImage(rgb.data, rgb.shape[1], rgb.shape[0], len(band)*rgb.shape[1],
-                                   QtGui.QImage.Format.Format_RGB888)
-            case _:
-                file = dDT[self.combo_box.currentText()]
-                npImg = self.open_file(file)
-                img = QtGui.QImage(npImg.data, npImg.shape[1], npImg.shape[0], QtGui.QImage.Format.Format_Grayscale16)
-                npImg = None
-        
-        pixmap = QtGui.QPixmap.fromImage(img)
-# todo: investigate sub-pixel interpolation
-#        pixmap = pixmap.scaled(8000, 8000, QtCore.Qt.AspectRatioMode.KeepAspectRatio, transformMode=QtCore.Qt.TransformationMode.SmoothTransformation)
+        product = self.combo_box.currentText() if (band == None) else band
+        npImg = self.get_product(pr, dt, product)
+        self.geo = self.get_georef(pr, dt, product)
+    # the viewer tiles the array itself, so only the visible part is ever converted for display
         self._pr = pr
-        return pixmap                
+        return npImg
+
+    def get_data_async(self, callback, band=None, progress=None):
+    # decodes the current selection on the worker pool. callback(data, pr) is called from the
+    # worker thread unless a newer request has made this one stale. progress(done, total) follows
+    # the stack statistics job an anomaly may need first (see start_stack).
+        void, pr, dt = self.get_current_selection()
+        if not void:
+            print('either path/row or date not selected selected')
+            return None
+        product = self.combo_box.currentText() if (band == None) else band
+        self._pr = pr
+        return self.submit(pr, dt, product, callback=callback, progress=progress)
+
+    def get_product(self, pr, dt, product):
+        key = self.get_key(pr, dt, product)
+        npImg = self.cache.get(key)
+        if (npImg is not None):
+            return npImg
+    # single bands are shown through windowed reads, so only the visible tiles are ever read
+        if re.fullmatch(r'B\d+', product, re.IGNORECASE):
+            return self.cache.put(key, raster_source(self, self.get_scene(pr, dt)[product.upper()]))
+        dDT = self.get_inputs(pr, dt, product)
+        npImg = self.disk.get(dDT, product)
+        if (npImg is None):
+            with stats.timer(f'decode {key[2]}'):
+                npImg = self.compute_product(dDT, product)
+            with stats.timer('disk cache write', n_bytes=npImg.nbytes):
+                self.disk.put(dDT, product, npImg)
+        else:
+            stats.count('disk cache hit')
+        return self.cache.put(key, npImg)
 
     def get_pr(self):
         return self._pr
 
     def get_data_coords(self, xy):
-        xoff, a, b, yoff, d, e=self.raster.GetGeoTransform()
-        x_map = a*xy[0] + b*xy[1] + xoff
-        y_map = d*xy[0] + e*xy[1] + yoff
-        tf = osr.CoordinateTransformation(self.srs, self.srs_wgs84)
-        lon, lat, _ = tf.TransformPoint(x_map, y_map)
-        return (lon,lat), (x_map,y_map)
+    # lon/lat and map coordinates of a pixel of the displayed scene
+        if (self.geo == None):
+            return (np.nan,np.nan), (np.nan,np.nan)
+        x_map, y_map = self.geo.pixel_to_map(xy[0], xy[1])
+        lon, lat = self.geo.map_to_lonlat(x_map, y_map)
+        return (lon,lat), (float(x_map),float(y_map))
+
+    def get_fit(self, pr, dt, dDT=None):
+    # sampled B6/B7 fit of the scene, computed once and kept in the catalog
+        c = self.catalog.get_fit(pr, dt)
+        if (c == None):
+            c, se = self.methane_fit_sample(self.get_scene(pr, dt) if (dDT == None) else dDT)
+            self.catalog.set_fit(pr, dt, c, n_sample=PREVIEW_SAMPLE)
+        return np.asarray(c)
+
+    def get_georef(self, pr, dt, product=None):
+    # built once per scene (and per band for single bands, as b8 is on a 15 m grid)
+        for key in [(pr, dt, product), (pr, dt, None)]:
+            if key in self.georefs:
+                return self.georefs[key]
+        dDT = self.get_scene(pr, dt)
+        band = product if (product in dDT) else None
+        file = dDT[band] if (band != None) else next(dDT[b] for b in ['B4','B6','B7','B2','B3'] if b in dDT)
+        return self.georefs.setdefault((pr, dt, band), georef(self, file))
+
+    def get_inputs(self, pr, dt, product):
+    # files a product of the scene is made from, by band; the anomaly also reads the path/row's stack
+        dDT = self.get_scene(pr, dt)
+        if (product.lower() != 'anomaly'):
+            return dDT
+        file = self.get_stack_file(pr)
+        if not os.path.exists(file): # built as a job of its own (start_stack), never on the decode pool
+            raise FileNotFoundError(f'no stack statistics for {pr}; build them first (stack_statistics)')
+        return dict(dDT, stack=file)
+
+    def get_key(self, pr, dt, product):
+    # product cache key. an anomaly is only valid for the stack it was made from, so its key names the
+    # stack file (a new set of dates gives a new name) and its modification time (a rebuild)
+        key = (pr, dt, product.lower())
+        if (key[2] == 'anomaly'):
+            file = self.get_stack_file(pr)
+            key += (os.path.basename(file), os.stat(file).st_mtime_ns if os.path.exists(file) else None)
+        return key
+
+    def get_offset(self, geo, geo_ref):
+    # pixel of the reference grid that pixel (0,0) of the grid falls on (same projection)
+        x, y = geo_ref.map_to_pixel(*geo.pixel_to_map(0, 0))
+        return int(np.round(x)), int(np.round(y))
+
+    def get_scene(self, pr, dt):
+        return self.catalog.get_scene(pr, dt)
+
+    def get_size(self, file):
+        raster = gdal.Open(file) if isinstance(file, str) else file
+        x0, y0 = self.get_trim(raster)
+        return raster.RasterYSize-y0, raster.RasterXSize-x0
+
+    def get_stack_file(self, pr):
+    # named after the B6/B7 files of every date, so adding or changing a date makes a new product
+        h = hashlib.sha1(f'stack:{STACK_BANDS}'.encode())
+        for dt in self.catalog.list_dt(pr):
+            dDT = self.get_scene(pr, dt)
+            for band in ['B6','B7']:
+                if band in dDT:
+                    st = os.stat(dDT[band])
+                    h.update(f'|{dDT[band]}:{st.st_mtime_ns}:{st.st_size}'.encode())
+        return os.path.join(self.dir, pr, self.disk.subdir, f'stack_{h.hexdigest()[:16]}.tif')
+
+    def get_trim(self, raster):
+        return get_trim(raster)
 
     def get_folder(self):
         return self.dir
 
     def gui(self, parent, width=None):
+        from PyQt6 import QtCore, QtWidgets # only the gui needs Qt; batch and cli runs never load it
         tlb = QtWidgets.QWidget(parent)
         layout = QtWidgets.QVBoxLayout(tlb)
         tlb.setLayout(layout)
@@ -127,76 +498,309 @@ class data_manager():
         self.combo_box.currentIndexChanged.connect(self.signal_band_changed)
         layout_bottom.addWidget(self.combo_box)
         layout.addLayout(layout_bottom)
-        self.combo_box.addItems(['B1','B2','B3','B4','B5','B6','B7','B10','RGB','Methane'])
+        self.combo_box.addItems(['B1','B2','B3','B4','B5','B6','B7','B10','RGB','Methane','Anomaly'])
         self.combo_box.setCurrentIndex(8)
         self.update_list()
 
-    def methane_image(self, dDT=None):
+    def lonlat_to_pixel(self, lon, lat):
+    # pixel (x, y) of the displayed scene for scalar or array lon/lat
+        return self.geo.lonlat_to_pixel(lon, lat)
+
+    def methane_anomaly(self, dDT, max_bytes=METHANE_BYTES):
+    # robust z of the date's residual against the per-pixel median and MAD of its path/row stack
+    # (dDT['stack'], see get_inputs and stack_statistics), mapped from [-Z_STRETCH, Z_STRETCH] to uint16
+        dirPR, dt = os.path.split(os.path.dirname(dDT['B6']))
+        pr = os.path.basename(dirPR)
+        stack = gdal.Open(dDT['stack'])
+        ox, oy = self.get_offset(self.get_georef(pr, dt), georef(self, stack, trim=False))
+        c = self.get_fit(pr, dt, dDT)
+        median, mad = [STACK_BANDS.index(key)+1 for key in ['median','mad']]
+        ny, nx = self.get_size(dDT['B6'])
+        out = np.empty((ny, nx), dtype=np.uint16)
+        for y0, (b6, b7) in self.read_blocks(dDT, max_bytes=max_bytes):
+            rows = b6.shape[0]
+            z = self.methane_residual(b6, b7, c)
+            z -= read_padded(stack, ox, y0+oy, nx, rows, band=median, fill=None, trim=False)
+            z /= np.float32(1.4826)*read_padded(stack, ox, y0+oy, nx, rows, band=mad, fill=None, trim=False)
+            z = np.nan_to_num(z, nan=0.0, posinf=Z_STRETCH, neginf=-Z_STRETCH)
+            np.clip(z, -Z_STRETCH, Z_STRETCH, out=z)
+            z += Z_STRETCH
+            z *= 65535/(2*Z_STRETCH)
+            out[y0:y0+rows] = z
+        return out
+
+    def methane_fit(self, dDT, max_bytes=METHANE_BYTES):
+    # least-squares line of B7 against B6 (the np.polyfit(b6, b7, 1) coefficients), merged
+    # block by block from the per-block means and co-moments so the sums stay well conditioned
+        n, mx, my, cxx, cxy = 0, 0.0, 0.0, 0.0, 0.0
+        for y0, (b6, b7) in self.read_blocks(dDT, max_bytes=max_bytes):
+            x = b6.ravel().astype(np.float64)
+            y = b7.ravel().astype(np.float64)
+            nb, mxb, myb = x.size, x.mean(), y.mean()
+            x -= mxb
+            y -= myb
+            dx, dy, nt = mxb-mx, myb-my, n+nb
+            cxx += np.dot(x, x) + dx*dx*n*nb/nt
+            cxy += np.dot(x, y) + dx*dy*n*nb/nt
+            mx += dx*nb/nt
+            my += dy*nb/nt
+            n = nt
+        slope = cxy/cxx
+        return np.array([slope, my-slope*mx])
+
+    def methane_image(self, dDT=None, max_bytes=METHANE_BYTES):
+    # B6/B7 regression residual stretched to 2%-98% and scaled to uint16. the fit, the residual
+    # range, the histogram and the stretch are each a streaming pass over row blocks, so apart
+    # from the output the memory used never exceeds max_bytes.
         if (dDT == None):
             void, pr, dt = self.get_current_selection()
             if not void:
                 print('either path/row or date not selected')
                 return None
-            dDT = self.d[pr]
-        b6 = self.open_file(dDT['B6']).astype(np.float32)
-        b7 = self.open_file(dDT['B7']).astype(np.float32)
-        c = np.polyfit(b6.flatten(), b7.flatten(), 1)
-        methane = ((c[0]*b6 + c[1]) - b7)
-        dim = methane.shape
-        methane = methane.flatten() - methane.min()
-        pct = np.cumsum(np.bincount(methane.astype(np.int64)))/methane.size
+            dDT = self.get_scene(pr, dt)
+        c = self.methane_fit(dDT, max_bytes=max_bytes)
+    # residual range
+        rmin, rmax = np.inf, -np.inf
+        for y0, (b6, b7) in self.read_blocks(dDT, max_bytes=max_bytes):
+            residual = self.methane_residual(b6, b7, c)
+            rmin, rmax = min(rmin, residual.min()), max(rmax, residual.max())
+    # histogram of the residual in unit bins above its minimum
+        hist = np.zeros(int(rmax-rmin)+1, dtype=np.int64)
+        for y0, (b6, b7) in self.read_blocks(dDT, max_bytes=max_bytes):
+            residual = self.methane_residual(b6, b7, c)
+            residual -= rmin
+            h = np.bincount(residual.ravel().astype(np.int64))
+            hist[:h.size] += h
+        pct = np.cumsum(hist)/hist.sum()
         r = [np.argmin(pct < 0.02), np.argmax(pct > 0.98)]
-        methane[methane < r[0]] = r[0]
-        methane[methane > r[1]] = r[1]
-        methane = (methane-methane.min())/(methane.max()-methane.min())
-        methane = methane.reshape(dim[0],dim[1])
-        methane = (methane*65535).astype(np.uint16)
-        b6, b7 = None, None
+    # stretch
+        methane = np.empty(self.get_size(dDT['B6']), dtype=np.uint16)
+        scale = 65535/(r[1]-r[0])
+        for y0, (b6, b7) in self.read_blocks(dDT, max_bytes=max_bytes):
+            residual = self.methane_residual(b6, b7, c)
+            residual -= rmin
+            np.clip(residual, r[0], r[1], out=residual)
+            residual -= r[0]
+            residual *= scale
+            methane[y0:y0+residual.shape[0]] = residual
         return methane
 
+    def methane_fit_error(self, dDT, n_sample=PREVIEW_SAMPLE):
+    # compares the sampled fit used by the preview against the exact streaming fit
+        c_sample, se = self.methane_fit_sample(dDT, n_sample=n_sample)
+        c = self.methane_fit(dDT)
+        diff = c_sample-c
+        d = {'exact':c.tolist(), 'n_sample':n_sample, 'sample':c_sample.tolist(),
+             'standard_error':se.tolist(), 'difference':diff.tolist(),
+             'relative_difference':(np.abs(diff)/np.abs(c)).tolist()}
+        print(f'methane fit ({n_sample} samples): slope {c_sample[0]:.6f} vs {c[0]:.6f}, '+
+              f'intercept {c_sample[1]:.3f} vs {c[1]:.3f}')
+        return d
+
+    def methane_fit_sample(self, dDT, n_sample=PREVIEW_SAMPLE):
+    # fit of B7 against B6 on a strided grid of about n_sample pixels, returned with the standard
+    # errors of the coefficients estimated from the sample itself
+        ny, nx = self.get_size(dDT['B6'])
+        by = max(2, min(ny, int(np.sqrt(n_sample*ny/nx))))
+        bx = max(2, min(nx, n_sample//by))
+        x, y = [self.read_window(dDT[key], buf_xsize=bx, buf_ysize=by, resample='nearest')
+                .ravel().astype(np.float64) for key in ['B6','B7']]
+        c = np.polyfit(x, y, 1)
+        n = x.size
+        sxx = np.sum((x-x.mean())**2)
+        s2 = np.sum((y-(c[0]*x+c[1]))**2)/(n-2)
+        se = np.array([np.sqrt(s2/sxx), np.sqrt(s2*(1/n+x.mean()**2/sxx))])
+        return c, se
+
+    def methane_preview(self, dDT, n_sample=PREVIEW_SAMPLE, size=PREVIEW_SIZE):
+    # fast methane_image for triage: sampled fit and a 2%-98% stretch taken from the
+    # overview-resolution residual, rendered at no more than size pixels on a side
+        c, se = self.methane_fit_sample(dDT, n_sample=n_sample)
+        ny, nx = self.get_size(dDT['B6'])
+        f = min(1, size/max(nx, ny))
+        bx, by = max(1, int(nx*f)), max(1, int(ny*f))
+        b6, b7 = [self.read_window(dDT[key], buf_xsize=bx, buf_ysize=by).astype(np.float32)
+                  for key in ['B6','B7']]
+        residual = self.methane_residual(b6, b7, c)
+        residual -= residual.min()
+        pct = np.cumsum(np.bincount(residual.ravel().astype(np.int64)))/residual.size
+        r = [np.argmin(pct < 0.02), np.argmax(pct > 0.98)]
+        np.clip(residual, r[0], r[1], out=residual)
+        residual -= r[0]
+        residual *= 65535/(r[1]-r[0])
+        return residual.astype(np.uint16)
+
+    def methane_residual(self, b6, b7, c):
+        residual = np.float32(c[0])*b6
+        residual += np.float32(c[1])
+        residual -= b7
+        return residual
+
     def open_file(self, file):
-        self.raster = gdal.Open(file)
-        self.srs = osr.SpatialReference()
-        self.srs.ImportFromWkt(self.raster.GetProjection())
-        npImg = np.array(self.raster.ReadAsArray())
-        for iDelete in range(2):
-            if (npImg.shape[iDelete] == 7991):
-                npImg = np.delete(npImg, (0), axis=(1-iDelete))
-        return npImg
+        return self.read_window(file)
 
     def parse(self, folder=None):
+    # only folders whose modification time changed since the last run are read again
         print(f'parsing folder: {self.dir}')
-        self.d.clear()
-        rexB = re.compile('_B.')
-        rexTIF = re.compile('.tif')
-        for basePR in os.listdir(self.dir):
-            print(f" path/row: {basePR}")
-            dPR = {}
-            dirPR = os.path.join(self.dir, basePR)
-            if not os.path.isdir(dirPR):
-                continue
-            for baseDT in os.listdir(dirPR):
-                print(f"  date: {baseDT}")
-                dirDT = os.path.join(dirPR, baseDT)
-                if not os.path.isdir(dirDT):
-                    continue
-                dDT = {}
-                for base in os.listdir(dirDT):
-                    if ((rexB.search(base) == None) or (rexTIF.search(base.lower()) == None)):
-                        continue
-                    band = str(f'B{int(base[base.find("_B")+2:base.lower().find(".tif")])}')
-                    dDT[band] = os.path.join(dirDT, base)                    
-                if (len(dDT) >= 6):
-                    dDT['date'] = self.format_date(baseDT)
-                    dPR[baseDT] = dDT
-            self.d[basePR] = dPR
+        changed = self.catalog.update()
+        if (len(changed) > 0):
+            print(f' {len(changed)} scenes updated')
         self.update_list()
 
+    def prefetch(self, pr, dt, product):
+    # decode the neighbouring dates of the path/row so stepping through the time series is instant
+        kDT = self.catalog.list_dt(pr, bands=get_bands(product))
+        if (dt not in kDT) or (product.lower() == 'anomaly'): # neighbours share one stack build
+            return None
+        i = kDT.index(dt)
+        for j in range(1, self.n_prefetch+1):
+            for k in [i+j, i-j]:
+                if (0 <= k < len(kDT)) and ((pr, kDT[k], product.lower()) not in self.cache):
+                    self.start(pr, kDT[k], product)
+
+    def pixel_series(self, pr, x, y, band=['B6','B7'], radius=0, fit=True):
+    # band values (the mean of a (2*radius+1)^2 window) and methane residual at pixel (x, y) of the
+    # displayed scene for every date of the path/row. each date is located through lon/lat, so dates
+    # on a shifted grid still sample the same place, and only the window is read. B6 and B7 are read
+    # for the residual in any case. with fit=False only the fits already in the catalog are used; the
+    # dates still without one have a NaN residual and are listed in series['pending'].
+        lon, lat = self.geo.pixel_to_lonlat(x, y)
+        kDT = self.catalog.list_dt(pr, bands=band)
+        key = band+[b for b in ['B6','B7'] if (b not in band)]+['methane']
+        n = 2*radius+1
+        def drill(dt):
+            dDT = self.get_scene(pr, dt)
+            px, py = self.get_georef(pr, dt).lonlat_to_pixel(lon, lat)
+            ix, iy = int(np.floor(px)), int(np.floor(py))
+            ny, nx = self.get_size(dDT[band[0]])
+            value = {k:np.nan for k in key}
+            if not ((0 <= ix < nx) and (0 <= iy < ny)):
+                return value
+            for k in set(band+['B6','B7']):
+                if k in dDT:
+                    value[k] = float(self.read_window(dDT[k], xoff=ix-radius, yoff=iy-radius,
+                                                      xsize=n, ysize=n).mean())
+            if ('B6' not in dDT) or ('B7' not in dDT):
+                return value
+            if fit or (self.catalog.get_fit(pr, dt) != None):
+                c = self.get_fit(pr, dt, dDT)
+                value['methane'] = c[0]*value['B6']+c[1]-value['B7']
+            else:
+                value['pending'] = True
+            return value
+        with stats.timer('pixel drill'):
+            value = list(self.drill_pool.map(drill, kDT))
+        d = {'date':[self.format_date(dt) for dt in kDT], 'dt':kDT, 'lonlat':(float(lon), float(lat)),
+             'pending':[dt for dt, v in zip(kDT, value) if v.get('pending')], 'pixel':(x, y), 'pr':pr}
+        for k in key:
+            d[k] = np.array([v[k] for v in value])
+        return d
+
+    def pixel_series_async(self, callback, x, y, band=['B6','B7'], radius=0):
+    # callback(series) is called from a worker thread. drills run on their own thread rather than
+    # the decode pool, so they never wait behind a decode, and a newer click drops a queued one. the
+    # series comes back as soon as the windows are read, with the residuals of the dates that have a
+    # stored fit; the missing fits are computed after that and the series is sent again (fill_series).
+        if (self._pr == None) or (self.geo == None):
+            return None
+        if (self.drill_request != None):
+            self.drill_request.cancel()
+        future = self.drill_runner.submit(self.pixel_series, self._pr, x, y, band=band, radius=radius,
+                                          fit=False)
+        self.drill_request = future
+        def done(f):
+            if f.cancelled():
+                return None
+            if (f.exception() != None):
+                print(f'pixel drill failed at {x}, {y}: {f.exception()}')
+                return None
+            if (callback != None):
+                callback(f.result())
+                if (len(f.result()['pending']) > 0) and (self.drill_request == future):
+                    self.fill_series(f.result(), future, callback)
+        future.add_done_callback(done)
+        return future
+
+    def fill_series(self, series, request, callback):
+    # fits the dates a pixel_series(fit=False) left pending, one task each on the drill pool, and calls
+    # back with a completed copy of the series once all are in. fits not yet started when a newer drill
+    # replaces the request are skipped; those that ran are kept in the catalog for the next one.
+        kI = [i for i, dt in enumerate(series['dt']) if dt in series['pending']]
+        methane = series['methane'].copy()
+        left = [len(kI)]
+        lock = threading.Lock()
+        def fit(i):
+            try:
+                if (self.drill_request == request):
+                    c = self.get_fit(series['pr'], series['dt'][i])
+                    methane[i] = c[0]*series['B6'][i]+c[1]-series['B7'][i]
+            except Exception as e:
+                print(f'methane fit failed for {series["pr"]} {series["dt"][i]}: {e}')
+            with lock:
+                left[0] -= 1
+                last = (left[0] == 0)
+            if last and (self.drill_request == request):
+                callback(dict(series, methane=methane, pending=[]))
+        for i in kI:
+            self.drill_pool.submit(fit, i)
+
+    def pixel_to_lonlat(self, x, y):
+    # lon/lat for scalar or array pixel coordinates of the displayed scene
+        return self.geo.pixel_to_lonlat(x, y)
+
+    def read_blocks(self, dDT, band=['B6','B7'], max_bytes=METHANE_BYTES):
+    # yields (first row, [float32 block per band]) over the scene in blocks that fit max_bytes
+        ny, nx = self.get_size(dDT[band[0]])
+        rows = max(1, max_bytes//(nx*METHANE_PIXEL_BYTES))
+        raster = [gdal.Open(dDT[key]) for key in band]
+        for y0 in range(0, ny, rows):
+            yield y0, [self.read_window(r, yoff=y0, ysize=rows).astype(np.float32) for r in raster]
+
+    def read_window(self, file, xoff=0, yoff=0, xsize=None, ysize=None,
+                    buf_xsize=None, buf_ysize=None, resample='average'):
+    # reads a pixel window of the (trimmed) band, optionally resampled to buf_xsize x buf_ysize.
+    # gdal serves decimated reads from the internal overviews when the file has them.
+        raster = gdal.Open(file) if isinstance(file, str) else file
+        x0, y0 = self.get_trim(raster)
+        ny, nx = raster.RasterYSize-y0, raster.RasterXSize-x0
+        xoff, yoff = max(0, xoff), max(0, yoff)
+        xsize = nx-xoff if (xsize == None) else min(xsize, nx-xoff)
+        ysize = ny-yoff if (ysize == None) else min(ysize, ny-yoff)
+        t0 = time.perf_counter()
+        npImg = raster.GetRasterBand(1).ReadAsArray(xoff+x0, yoff+y0, xsize, ysize,
+                                                    buf_xsize=buf_xsize, buf_ysize=buf_ysize,
+                                                    resample_alg=RESAMPLE[resample])
+        stats.add('read', time.perf_counter()-t0, n_bytes=npImg.nbytes)
+        return npImg
+
+    def rgb_image(self, dDT, band=['B4','B3','B2']):
+    # 8-bit composite of the bands, built straight into the contiguous RGB888 buffer the viewer
+    # uploads. each band is read by its own thread (gdal releases the gil) in row blocks and
+    # reduced with a shift, so no full uint16 or float band is ever held.
+        ny, nx = self.get_size(dDT[band[0]])
+        rgb = np.empty((ny, nx, len(band)), dtype=np.uint8)
+        def read(i):
+            raster = gdal.Open(dDT[band[i]])
+            for y0 in range(0, ny, BLOCK_ROWS):
+                npUint = self.read_window(raster, yoff=y0, ysize=BLOCK_ROWS)
+                np.right_shift(npUint, 8, out=rgb[y0:y0+npUint.shape[0],:,i], casting='unsafe')
+        list(self.io_pool.map(read, range(len(band))))
+        return rgb
+
+    def set_reference(self, file):
+    # georeference used by get_data_coords
+        self.geo = georef(self, file)
+
     def set_working_folder(self, dir=None):
         if (dir != None):
             self.dir = dir
+            self.cache.clear()
+            self.georefs.clear()
             if not os.path.exists(self.dir):
                 os.mkdir(self.dir)
+            self.catalog.close()
+            self.catalog = catalog(self.dir)
+            self.disk = disk_cache(self.dir, max_bytes=self.disk_bytes)
             self.parse()
 
     def signal_clicked_dt(self, event):
@@ -215,27 +819,128 @@ class data_manager():
                 listener.signal_datamanager(event)
 
     def signal_band_changed(self, event):
+    # list the dates that hold the bands of the new product
+        self.update_list()
     # notify the listeners
         if (self.listener != None):
             for listener in self.listener:
                 listener.signal_datamanager(event)
 
+    def stack_statistics(self, pr, cancel=None, max_bytes=STACK_BYTES, n_workers=None, progress=None):
+    # per-pixel mean, std, median, MAD, peak robust z and date count of the B6/B7 residual over every
+    # date of the path/row, written as a float32 GeoTIFF on the first date's grid and returned as its
+    # path. tiles of whole source blocks are spread over worker processes; each tile holds all dates,
+    # so its size is set by max_bytes, and results are written as they arrive, so the memory used does
+    # not grow with the scene or the number of dates. builds run one at a time (each one alone fills
+    # max_bytes); a concurrent request for the same path/row waits for the running build and reuses
+    # its file. setting the cancel event stops the build (CancelledError).
+        with self.stack_lock:
+            return self.build_stack(pr, cancel=cancel, max_bytes=max_bytes, n_workers=n_workers,
+                                    progress=progress)
+
+    def start_stack(self, pr, n_workers=None, progress=None):
+    # builds the stack statistics of the path/row as a job of its own, off the decode pool, so decodes
+    # go on meanwhile; a job already queued or running for the path/row is shared. progress(done,
+    # total) is called per tile and with (0, 0) when the job ends; cancel_stack stops it. half of the
+    # cores are left to the GUI and the decodes.
+        with self.lock:
+            job = self.stack_jobs.get(pr)
+            if (job != None) and not job[0].done():
+                return job[0]
+            cancel = threading.Event()
+            n_workers = max(1, os.cpu_count()//2) if (n_workers == None) else n_workers
+            future = self.stack_runner.submit(self.stack_statistics, pr, cancel=cancel, n_workers=n_workers,
+                                              progress=progress)
+            self.stack_jobs[pr] = (future, cancel)
+        def done(f):
+            with self.lock:
+                if (self.stack_jobs.get(pr, (None,))[0] is f):
+                    del self.stack_jobs[pr]
+            if not f.cancelled() and (f.exception() != None):
+                print(f'stack statistics of {pr}: {f.exception()}')
+            if (progress != None):
+                progress(0, 0)
+        future.add_done_callback(done)
+        return future
+
+    def start(self, pr, dt, product):
+    # returns the future decoding the product, sharing it with any request already in flight
+        key = self.get_key(pr, dt, product)
+        with self.lock:
+            future = self.inflight.get(key)
+            if (future != None) and not future.cancelled():
+                return future
+            future = self.pool.submit(self.get_product, pr, dt, product)
+            self.inflight[key] = future
+        future.add_done_callback(lambda f: self.stop(key, f))
+        return future
+
+    def stop(self, key, future):
+        with self.lock:
+            if (self.inflight.get(key) is future):
+                del self.inflight[key]
+
+    def submit(self, pr, dt, product, callback=None, progress=None):
+        self.cancel()
+    # the anomaly reads the stack of the path/row, which is built first as a job of its own
+        if (product.lower() == 'anomaly') and not os.path.exists(self.get_stack_file(pr)):
+            request = object() # stands for this request until the stack is built
+            self.request = request
+            def built(f):
+                if (self.request is request) and not f.cancelled() and (f.exception() == None):
+                    self.submit(pr, dt, product, callback=callback, progress=progress)
+            stack = self.start_stack(pr, progress=progress)
+            stack.add_done_callback(built)
+            return stack
+        preview = self.preview and (product.lower() == 'methane') and \
+            ((pr, dt, 'methane') not in self.cache)
+        future = self.start(pr, dt, product)
+        self.request = future
+        delivered = []
+        def done(f):
+            if f.cancelled() or (f is not self.request):
+                return None
+            if (f.exception() != None):
+                print(f'failed to decode {product} for {pr} {dt}: {f.exception()}')
+                return None
+            with self.deliver_lock:
+                delivered.append(f)
+                self.geo = self.get_georef(pr, dt, product)
+                if (callback != None):
+                    callback(f.result(), pr)
+    # the preview is shown while the full-resolution image is refined, and never after it
+        if preview:
+            shape = self.get_size(self.get_scene(pr, dt)['B6'])
+            def done_preview(f):
+                if f.cancelled() or (future is not self.request) or (f.exception() != None):
+                    return None
+                with self.deliver_lock:
+                    self.geo = self.get_georef(pr, dt, product)
+                    if (len(delivered) == 0) and (callback != None):
+                        callback(preview_source(f.result(), shape), pr)
+            self.start(pr, dt, 'methane preview').add_done_callback(done_preview)
+        future.add_done_callback(done)
+        self.prefetch(pr, dt, product)
+        return future
+
     def update_list(self):
-        if (self.listPR == None) or (len(self.d) == 0):
+        if (self.listPR == None):
+            return None
+        kPR = self.catalog.list_pr()
+        if (len(kPR) == 0):
             return None
         itemPR = self.listPR.currentItem()
-        kPR = list(self.d.keys())
-        pr = itemPR.text() if itemPR else kPR[0]
-        kDT = list(self.d[pr].keys())
+        pr = itemPR.text() if itemPR and (itemPR.text() in kPR) else kPR[0]
+        bands = get_bands(self.combo_box.currentText()) if (self.combo_box != None) else None
+        kDT = self.catalog.list_dt(pr, bands=bands)
         itemDT = self.listDT.currentItem()
-        if (len(kDT) == 0):
-            return None
-        dt = itemDT.text() if itemDT else kDT[0]
+        dt = itemDT.text() if itemDT else None
         self.listPR.clear()
-        self.listPR.addItems(self.d.keys())
+        self.listPR.addItems(kPR)
         self.listDT.clear()
-        self.listDT.addItems(list(self.d[pr].keys()))
-        self.listDT.setCurrentItem(self.listDT.item(0))
+        self.listDT.addItems(kDT)
+        if (len(kDT) > 0):
+            self.listDT.setCurrentItem(self.listDT.item(0))
         for i in range(len(self.listPR)):
             item = self.listPR.item(i)
             if (item.text() == pr):
@@ -247,6 +952,88 @@ class data_manager():
                 self.listDT.setCurrentItem(item)
                 break
 
+def bench_rgb(dir='C:\\data\\landsat', pr=None, dt=None, n=3):
+# times the serial float-division composite against rgb_image and reports peak memory
+    dm = data_manager(working_folder=dir)
+    pr = dm.catalog.list_pr()[0] if (pr == None) else pr
+    dt = dm.catalog.list_dt(pr)[0] if (dt == None) else dt
+    dDT = dm.get_scene(pr, dt)
+    def serial():
+        npByte = []
+        for key in ['B4','B3','B2']:
+            npUint = dm.open_file(dDT[key])
+            npByte.append((npUint/256).astype(np.uint8))
+            npUint = None
+        rgb = np.zeros((npByte[0].shape[0], npByte[0].shape[1], 3), dtype=np.uint8)
+        for i in range(3):
+            rgb[:,:,i] = npByte[i].data
+        return rgb
+    result = {}
+    for name, f in [('serial', serial), ('rgb_image', lambda: dm.rgb_image(dDT))]:
+        t = []
+        for i in range(n):
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            rgb = f()
+            t.append(time.perf_counter()-t0)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rgb = None
+        result[name] = (min(t), peak)
+        print(f'{name:>10}: {min(t):.3f} s, peak {peak/2**20:.0f} MB')
+    print(f'speedup: {result["serial"][0]/result["rgb_image"][0]:.1f}x '+
+          f'memory: {result["serial"][1]/result["rgb_image"][1]:.1f}x')
+    return result
+
+def bench_methane(dir='C:\\data\\landsat', pr=None, dt=None):
+# compares methane_image against the in-memory np.polyfit implementation
+    dm = data_manager(working_folder=dir)
+    pr = dm.catalog.list_pr()[0] if (pr == None) else pr
+    dt = dm.catalog.list_dt(pr)[0] if (dt == None) else dt
+    dDT = dm.get_scene(pr, dt)
+    def in_memory():
+        b6 = dm.open_file(dDT['B6']).astype(np.float32)
+        b7 = dm.open_file(dDT['B7']).astype(np.float32)
+        c = np.polyfit(b6.flatten(), b7.flatten(), 1)
+        methane = ((c[0]*b6 + c[1]) - b7)
+        dim = methane.shape
+        methane = methane.flatten() - methane.min()
+        pct = np.cumsum(np.bincount(methane.astype(np.int64)))/methane.size
+        r = [np.argmin(pct < 0.02), np.argmax(pct > 0.98)]
+        methane[methane < r[0]] = r[0]
+        methane[methane > r[1]] = r[1]
+        methane = (methane-methane.min())/(methane.max()-methane.min())
+        return (methane.reshape(dim[0],dim[1])*65535).astype(np.uint16)
+    result = {}
+    for name, f in [('in_memory', in_memory), ('methane_image', lambda: dm.methane_image(dDT))]:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        result[name] = f()
+        t = time.perf_counter()-t0
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{name:>14}: {t:.3f} s, peak {peak/2**20:.0f} MB')
+    diff = np.abs(result['in_memory'].astype(np.int32)-result['methane_image'])
+    print(f'max difference: {diff.max()} mean difference: {diff.mean():.3f} (of 65535)')
+    return diff.max()
+
+def bench_stack(dir='C:\\data\\landsat', pr=None, max_bytes=[256*2**20, STACK_BYTES], n_workers=None):
+# times stack_statistics at each memory budget; the tile size changes, the result must not
+    dm = data_manager(working_folder=dir)
+    pr = dm.catalog.list_pr()[0] if (pr == None) else pr
+    result = []
+    for mb in max_bytes:
+        file = dm.get_stack_file(pr)
+        if os.path.exists(file):
+            os.remove(file)
+        t0 = time.perf_counter()
+        file = dm.stack_statistics(pr, max_bytes=mb, n_workers=n_workers)
+        print(f'{mb/2**20:>6.0f} MB: {time.perf_counter()-t0:.1f} s')
+        result.append(gdal.Open(file).ReadAsArray())
+    diff = np.nanmax(np.abs(result[0]-result[-1]))
+    print(f'max difference between budgets: {diff}')
+    return diff
+
 def test_data_manager():
     dir = 'C:\\data\\landsat'
     dm = data_manager(working_folder=dir)
@@ -1,6 +1,47 @@
+import math
+import numpy as np
+from metrics import stats
 from PyQt6 import QtCore, QtGui, QtWidgets
 
 SCALE_FACTOR = 1.1
+TILE_SIZE = 512 # tile edge in pixels at the tile's own pyramid level
+
+#--------------------------------------------------------------------------------------------------
+#+
+# wraps an in-memory array so that it can be read like a raster source. each pyramid level is a
+# strided view of the array, so no decimated copies are ever held.
+#-
+class array_source():
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __init__(self, data):
+        self.data = data
+        self.shape = data.shape
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # returns the window [x0:x1, y0:y1] sampled every step pixels
+    #-
+    def read(self, x0, y0, x1, y1, step=1):
+        return self.data[y0:y1:step, x0:x1:step]
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+def to_qimage(data):
+    data = np.ascontiguousarray(data)
+    h, w = data.shape[0], data.shape[1]
+    if (data.ndim == 3):
+        img = QtGui.QImage(data.data, w, h, 3*w, QtGui.QImage.Format.Format_RGB888)
+    elif (data.dtype == np.uint8):
+        img = QtGui.QImage(data.data, w, h, w, QtGui.QImage.Format.Format_Grayscale8)
+    else:
+        data = data.astype(np.uint16, copy=False)
+        img = QtGui.QImage(data.data, w, h, 2*w, QtGui.QImage.Format.Format_Grayscale16)
+# the QImage only borrows the buffer; copy so the array can be released
+    return img.copy()
 
 class data_view(QtWidgets.QGraphicsView):
     signal_coords_changed = QtCore.pyqtSignal(QtCore.QPoint)
@@ -14,11 +55,11 @@ class data_view(QtWidgets.QGraphicsView):
         self._zoom = 0
         self._pinned = False
         self._empty = True
+        self._level = 0
+        self._rect = QtCore.QRectF()
+        self._source = None
+        self._tiles = {}
         self._scene = QtWidgets.QGraphicsScene(self)
-        self.pixmap_item = QtWidgets.QGraphicsPixmapItem()
-        self.pixmap_item.setShapeMode(
-            QtWidgets.QGraphicsPixmapItem.ShapeMode.BoundingRectShape)
-        self._scene.addItem(self.pixmap_item)
         self.setScene(self._scene)
         self.setTransformationAnchor(QtWidgets.QGraphicsView.ViewportAnchor.AnchorUnderMouse)
         self.setResizeAnchor(QtWidgets.QGraphicsView.ViewportAnchor.AnchorUnderMouse)
@@ -27,17 +68,34 @@ class data_view(QtWidgets.QGraphicsView):
         self.setBackgroundBrush(QtGui.QBrush(QtGui.QColor(30, 30, 30)))
         self.setFrameShape(QtWidgets.QFrame.Shape.NoFrame)
 
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def clear_tiles(self):
+        for item in self._tiles.values():
+            self._scene.removeItem(item)
+        self._tiles.clear()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_level(self):
+        scale = self.transform().m11()
+        if (scale <= 0) or self._rect.isNull():
+            return 0
+        n_level = max(0, math.ceil(math.log2(max(self._rect.width(), self._rect.height())/TILE_SIZE)))
+        return min(n_level, max(0, math.floor(math.log2(1/scale))))
+
     #----------------------------------------------------------------------------------------------
     #+
     #-
     def get_point(self, pos=None):
-        if self.pixmap_item.isUnderMouse():
-            if pos is None:
-                pos = self.mapFromGlobal(QtGui.QCursor.pos())
-            point = self.mapToScene(pos).toPoint()
-        else:
-            point = QtCore.QPoint()
-        return point
+        if pos is None:
+            pos = self.mapFromGlobal(QtGui.QCursor.pos())
+        point = self.mapToScene(pos)
+        if not self.is_on_data(point):
+            return QtCore.QPoint()
+        return point.toPoint()
 
     #----------------------------------------------------------------------------------------------
     #+
@@ -45,6 +103,12 @@ class data_view(QtWidgets.QGraphicsView):
     def hasData(self):
         return not self._empty
 
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def is_on_data(self, point):
+        return (not self._empty) and self._rect.contains(point)
+
     #----------------------------------------------------------------------------------------------
     #+
     #-
@@ -63,7 +127,7 @@ class data_view(QtWidgets.QGraphicsView):
     #+
     #-
     def mousePressEvent(self, event):
-        if self.pixmap_item.isUnderMouse():
+        if self.is_on_data(self.mapToScene(event.position().toPoint())):
             self.update_crosshairs(event.position().toPoint())
         self.setDragMode(QtWidgets.QGraphicsView.DragMode.ScrollHandDrag)
         return super().mousePressEvent(event)
@@ -80,7 +144,7 @@ class data_view(QtWidgets.QGraphicsView):
     #-
     def reset(self, scale=1):
         print("reset")
-        rect = QtCore.QRectF(self.pixmap_item.pixmap().rect())
+        rect = QtCore.QRectF(self._rect)
         if not rect.isNull():
             self.setSceneRect(rect)
             if (scale := max(1, scale)) == 1:
@@ -93,7 +157,8 @@ class data_view(QtWidgets.QGraphicsView):
                 factor = min(viewrect.width() / scenerect.width(),
                              viewrect.height() / scenerect.height()) * scale
                 self.scale(factor, factor)
-                self.centerOn(self.pixmap_item)
+                self.centerOn(rect.center())
+                self.update_tiles()
                 self.update_coordinates()
 
     #----------------------------------------------------------------------------------------------
@@ -101,18 +166,33 @@ class data_view(QtWidgets.QGraphicsView):
     #-
     def resizeEvent(self, event):
         super().resizeEvent(event)
+        self.update_tiles()
 
     #----------------------------------------------------------------------------------------------
     #+
     #-
-    def set_data(self, pixmap=None, reset=False):
-        if pixmap and not pixmap.isNull():
+    def scrollContentsBy(self, dx, dy):
+        super().scrollContentsBy(dx, dy)
+        self.update_tiles()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def set_data(self, data=None, reset=False):
+        self.clear_tiles()
+        if isinstance(data, np.ndarray):
+            data = array_source(data)
+        if (data != None) and (data.shape[0] > 0) and (data.shape[1] > 0):
             self._empty = False
-            self.pixmap_item.setPixmap(pixmap)
+            self._source = data
+            self._rect = QtCore.QRectF(0, 0, data.shape[1], data.shape[0])
+            self._scene.setSceneRect(self._rect)
         else:
             self._empty = True
+            self._source = None
+            self._rect = QtCore.QRectF()
             self.setDragMode(QtWidgets.QGraphicsView.DragMode.NoDrag)
-            self.pixmap_item.setPixmap(QtGui.QPixmap())
+        self.update_tiles()
         if (reset):
             self._zoom = 0
             self.reset(SCALE_FACTOR ** self._zoom)
@@ -137,6 +217,45 @@ class data_view(QtWidgets.QGraphicsView):
         point = self.get_point(pos=pos)
         self.signal_coords_selected.emit(point)
 
+    #----------------------------------------------------------------------------------------------
+    #+
+    # builds the tiles of the current pyramid level that intersect the viewport and evicts the rest
+    #-
+    def update_tiles(self):
+        if self._empty:
+            return None
+        visible = self.mapToScene(self.viewport().rect()).boundingRect().intersected(self._rect)
+        if visible.isEmpty():
+            self.clear_tiles()
+            return None
+        self._level = self.get_level()
+        step = 2**self._level
+        extent = TILE_SIZE*step
+        ny, nx = self._source.shape[0], self._source.shape[1]
+        col = range(int(visible.left()//extent), int(math.ceil(visible.right()/extent)))
+        row = range(int(visible.top()//extent), int(math.ceil(visible.bottom()/extent)))
+        wanted = set((self._level, c, r) for c in col for r in row)
+        for key in list(self._tiles.keys()):
+            if key not in wanted:
+                self._scene.removeItem(self._tiles.pop(key))
+        for key in wanted:
+            if key in self._tiles:
+                continue
+            _, c, r = key
+            x0, y0 = c*extent, r*extent
+            x1, y1 = min(nx, x0+extent), min(ny, y0+extent)
+            if (x0 >= x1) or (y0 >= y1):
+                continue
+            data = self._source.read(x0, y0, x1, y1, step=step)
+            with stats.timer('render tile', n_bytes=data.nbytes):
+                pixmap = QtGui.QPixmap.fromImage(to_qimage(data))
+            item = QtWidgets.QGraphicsPixmapItem(pixmap)
+            item.setShapeMode(QtWidgets.QGraphicsPixmapItem.ShapeMode.BoundingRectShape)
+            item.setPos(x0, y0)
+            item.setScale(step)
+            self._scene.addItem(item)
+            self._tiles[key] = item
+
     #----------------------------------------------------------------------------------------------
     #+
     #-
@@ -163,5 +282,6 @@ class data_view(QtWidgets.QGraphicsView):
                 else:
                     factor = 1 / SCALE_FACTOR ** abs(step)
                 self.scale(factor, factor)
+                self.update_tiles()
             else:
                 self.reset()
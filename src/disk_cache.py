@@ -0,0 +1,153 @@
+import glob
+import hashlib
+import numpy as np
+import os
+import threading
+
+# derived products and their source files; the anomaly also depends on the stack statistics of the
+# path/row, passed as dDT['stack']
+PRODUCTS = {'anomaly':['B6','B7','stack'], 'methane':['B6','B7'], 'rgb':['B4','B3','B2']}
+VERSION = 1 # bump when a product's algorithm changes so existing entries are recomputed
+
+#--------------------------------------------------------------------------------------------------
+#+
+# derived products saved next to their scene as .npy files that are memory-mapped on load. each
+# entry is named after a hash of the source band paths and modification times, so an entry made
+# from bands that have since changed is never matched. the total size is kept under max_bytes by
+# removing the least recently used entries. the product cache keeps entries mapped while they are
+# shown, and windows cannot remove or replace a mapped file, so an entry still in use is left for
+# a later pass rather than failing the caller.
+#-
+class disk_cache():
+
+    subdir = '.products'
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __init__(self, folder, max_bytes=20*1024**3):
+        self.dir = folder
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __str__(self):
+        return f'disk cache: {self.dir} ({self.get_size()/2**20:.1f}/{self.max_bytes/2**20:.1f} MB)'
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def clear(self, pr=None):
+        with self.lock:
+            for file in self.get_files(pr=pr):
+                self.remove(file)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def enforce_limit(self):
+        with self.lock:
+            files = []
+            for file in self.get_files():
+                try:
+                    files.append((os.stat(file), file))
+                except FileNotFoundError: # removed by another process sharing the folder
+                    continue
+            total = sum(st.st_size for st, _ in files)
+            for st, file in sorted(files, key=lambda f: f[0].st_mtime):
+                if (total <= self.max_bytes):
+                    break
+                if self.remove(file):
+                    total -= st.st_size
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # returns the memory-mapped product, or None when it is missing or stale
+    #-
+    def get(self, dDT, product):
+        file = self.get_file(dDT, product)
+        if (file == None):
+            return None
+        try:
+            os.utime(file) # most recently used
+            return np.load(file, mmap_mode='r')
+        except FileNotFoundError: # missing, or evicted since
+            return None
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_file(self, dDT, product):
+        product = product.lower()
+        if product not in PRODUCTS:
+            return None
+        h = hashlib.sha1(f'{product}:{VERSION}'.encode())
+        for band in PRODUCTS[product]:
+            st = os.stat(dDT[band])
+            h.update(f'|{dDT[band]}:{st.st_mtime_ns}:{st.st_size}'.encode())
+        dir = os.path.join(os.path.dirname(dDT[PRODUCTS[product][0]]), self.subdir)
+        return os.path.join(dir, f'{product}_{h.hexdigest()[:16]}.npy')
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_files(self, pr=None):
+        return glob.glob(os.path.join(self.dir, '*' if (pr == None) else pr, '*', self.subdir, '*.npy'))
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_size(self):
+        n_bytes = 0
+        for file in self.get_files():
+            try:
+                n_bytes += os.path.getsize(file)
+            except FileNotFoundError:
+                continue
+        return n_bytes
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def has(self, dDT, product):
+        file = self.get_file(dDT, product)
+        return (file != None) and os.path.exists(file)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # saves the product, replacing any stale entry of the same product for the scene
+    #-
+    def put(self, dDT, product, data):
+        file = self.get_file(dDT, product)
+        if (file == None):
+            return None
+        dir = os.path.dirname(file)
+        os.makedirs(dir, exist_ok=True)
+        with self.lock:
+            for stale in glob.glob(os.path.join(dir, product.lower()+'_*.npy')):
+                if (stale != file):
+                    self.remove(stale)
+        tmp = f'{file}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, np.ascontiguousarray(data))
+        try:
+            os.replace(tmp, file)
+        except OSError: # the entry was saved meanwhile and is mapped; it holds the same product
+            os.remove(tmp)
+        self.enforce_limit()
+        return file
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # removes an entry and returns whether it is gone; an entry that is still mapped stays
+    #-
+    def remove(self, file):
+        try:
+            os.remove(file)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        return True
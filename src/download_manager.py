@@ -0,0 +1,409 @@
+import hashlib
+import json
+import os
+import requests
+import tarfile
+import threading
+import time
+import urllib3
+from concurrent.futures import ThreadPoolExecutor, wait
+from metrics import stats
+
+STREAM_STATE = b'{"mode": "stream"' # start of the .part file of a streamed bundle
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+class download_cancelled(Exception):
+    pass
+
+#--------------------------------------------------------------------------------------------------
+#+
+# bounded pool of downloads. partial files are kept as <id>.part and resumed with an HTTP Range
+# request, failed transfers are retried with exponential backoff, and per-file and total progress
+# (bytes, bytes/s, ETA) is tracked for reporting.
+#-
+class download_manager():
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __init__(self, backoff=2.0, chunk_size=2**20, log=print, max_backoff=120.0, n_workers=4,
+                 retries=5, session=None, timeout=60):
+        self.backoff = backoff
+        self.cancelled = threading.Event()
+        self.chunk_size = chunk_size
+        self.futures = []
+        self.listener = []
+        self.lock = threading.Lock()
+        self.log = log
+        self.max_backoff = max_backoff
+        self.pool = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix='download')
+        self.progress = {}
+        self.retries = retries
+        self.session = requests.Session() if (session == None) else session
+        self.timeout = timeout
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __str__(self):
+        t = self.get_total()
+        s = f'{t["done"]}/{t["files"]} files, {format_bytes(t["bytes"])}'
+        if t['total']:
+            s += f' of {format_bytes(t["total"])}'
+        s += f', {format_bytes(t["rate"])}/s'
+        if (t['eta'] != None):
+            s += f', ETA {format_time(t["eta"])}'
+        return s
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # listener(url, progress) is called from the download threads whenever a file's progress changes
+    #-
+    def add_listener(self, listener):
+        self.listener.append(listener)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # drops the queued downloads and stops the running ones after their current chunk. partial
+    # files are kept, so the next attempt resumes them.
+    #-
+    def cancel(self):
+        self.cancelled.set()
+        with self.lock:
+            for future in self.futures:
+                future.cancel()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def check_cancelled(self, url):
+        if self.cancelled.is_set():
+            raise download_cancelled(url)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # downloads the url into folder and returns the path of the completed file. when extract is
+    # given the url must be a tar bundle: it is unpacked while it downloads, members for which
+    # extract(name) is true are written to folder, and folder is returned.
+    #-
+    def download(self, url, folder, extract=None):
+        part = os.path.join(folder, get_id(url)+'.part')
+        self.update(url, name=os.path.basename(part), status='starting', t0=time.time())
+        attempt = 0
+        while True:
+            offset = get_offset(part, extract != None)
+            try:
+                self.check_cancelled(url)
+                if (extract != None):
+                    return self.stream(url, folder, part, offset, extract)
+                return self.transfer(url, folder, part, offset)
+            except download_cancelled:
+                self.update(url, status='cancelled')
+                raise
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    requests.HTTPError, tarfile.ReadError, urllib3.exceptions.HTTPError) as e:
+            # tar and urllib3 errors of a dropped stream carry no response; they are retried
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if (status != None) and (status < 500) and (status != 429):
+                    self.update(url, status='failed')
+                    raise
+            # a transfer that moved forward is not counted as a failed attempt
+                if (get_offset(part, extract != None) > offset):
+                    attempt = 0
+                attempt += 1
+                if (attempt > self.retries):
+                    self.update(url, status='failed')
+                    raise
+                stats.count('download retry')
+                delay = min(self.max_backoff, self.backoff*2**(attempt-1))
+                self.log(f' {os.path.basename(part)}: {e.__class__.__name__}, retry {attempt}/{self.retries} in {delay:.0f} s')
+                self.update(url, status=f'retry {attempt}')
+                self.cancelled.wait(delay)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # writes one member of the streamed bundle to file; a partly written member is removed
+    #-
+    def extract_member(self, url, tar, m, file):
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        tmp = file+'.tmp'
+        try:
+            with stats.timer('stream extract', n_bytes=m.size):
+                with tar.extractfile(m) as src, open(tmp, 'wb') as dst:
+                    while (data := src.read(self.chunk_size)):
+                        self.check_cancelled(url)
+                        dst.write(data)
+            os.replace(tmp, file)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_progress(self, url=None):
+        with self.lock:
+            if (url != None):
+                return dict(self.progress.get(url, {}))
+            return {url:dict(p) for url, p in self.progress.items()}
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_total(self):
+        with self.lock:
+            p = list(self.progress.values())
+        n_bytes = sum(d['bytes'] for d in p)
+        total = sum(d['total'] for d in p if d['total'])
+        rate = sum(d['rate'] for d in p if (d['status'] == 'downloading'))
+        eta = (total-n_bytes)/rate if (rate > 0) and all(d['total'] for d in p) else None
+        return {'bytes':n_bytes, 'done':sum(d['status'] == 'done' for d in p), 'eta':eta,
+                'files':len(p), 'rate':rate, 'total':total}
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # the bundle is read as a tar stream. after each member the offset of the next header is saved
+    # in the .part file, so a dropped connection resumes from the member it was in. members are
+    # written through <member>.tmp, which is removed when the transfer is interrupted.
+    #-
+    def stream(self, url, folder, part, offset, extract):
+        headers = {'Range':f'bytes={offset}-'} if (offset > 0) else {}
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            if (r.status_code == 416): # the saved offset is past the end of this file; start over
+                os.remove(part)
+                return self.stream(url, folder, part, 0, extract)
+            r.raise_for_status()
+            if (r.status_code != 206):
+                offset = 0
+            size = int(r.headers.get('Content-Length', 0))
+            total = offset+size if size else None
+            self.update(url, bytes=offset, name=get_filename(r, os.path.basename(part)), rate=0.0,
+                        status='downloading', t1=time.time(), b1=offset, total=total)
+            r.raw.decode_content = True
+            reader = stream_reader(r.raw, lambda n: self.update(url, bytes=offset+n))
+        # resuming after the last member leaves only the end-of-archive blocks, which tarfile
+        # rejects as an empty file: every member is done
+            if (offset == 0) or (reader.peek(tarfile.BLOCKSIZE).strip(b'\0') != b''):
+                with tarfile.open(fileobj=reader, mode='r|') as tar:
+                    for m in tar:
+                        self.check_cancelled(url)
+                        file = get_member_path(folder, m.name)
+                        if (file == None):
+                            self.log(f' skipped {m.name}: outside the download folder')
+                        elif m.isfile() and extract(m.name) and not os.path.exists(file):
+                            self.log(f' {m.name}')
+                            self.extract_member(url, tar, m, file)
+                    # members that were not wanted are skipped by the stream without being stored
+                        n_block = (m.size+tarfile.BLOCKSIZE-1)//tarfile.BLOCKSIZE
+                        with open(part, 'w') as f:
+                            json.dump({'mode':'stream', 'offset':offset+m.offset_data+n_block*tarfile.BLOCKSIZE}, f)
+        os.remove(part)
+        p = self.update(url, status='done')
+        stats.add('download', time.time()-p['t1'], n_bytes=p['bytes']-p['b1'])
+        self.log(f' extracted {p["name"]} ({format_bytes(p["bytes"]-p["b1"])} at {format_bytes(p["rate"])}/s)')
+        return folder
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # clears the cancel flag and the progress of finished downloads before a new job
+    #-
+    def reset(self):
+        self.cancelled.clear()
+        with self.lock:
+            self.progress = {url:p for url, p in self.progress.items()
+                             if p['status'] not in ['done','failed','cancelled']}
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # queues the url; on_done(file) runs on the download thread after the file is complete
+    #-
+    def submit(self, url, folder, extract=None, on_done=None):
+        def run():
+            file = self.download(url, folder, extract=extract)
+            if (on_done != None):
+                on_done(file)
+            return file
+        future = self.pool.submit(run)
+        with self.lock:
+            self.futures.append(future)
+        return future
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def transfer(self, url, folder, part, offset):
+        headers = {'Range':f'bytes={offset}-'} if (offset > 0) else {}
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as r:
+            if (r.status_code == 416): # the partial file is not a prefix of this file; start over
+                os.remove(part)
+                return self.transfer(url, folder, part, 0)
+            r.raise_for_status()
+            if (r.status_code != 206):
+                offset = 0
+            file = os.path.join(folder, get_filename(r, os.path.basename(part)[:-5]))
+            size = int(r.headers.get('Content-Length', 0))
+            total = offset+size if size else None
+            self.update(url, bytes=offset, name=os.path.basename(file), rate=0.0, status='downloading',
+                        t1=time.time(), b1=offset, total=total)
+            with open(part, 'ab' if (offset > 0) else 'wb') as f:
+                n = offset
+                for data in r.iter_content(chunk_size=self.chunk_size):
+                    self.check_cancelled(url)
+                    f.write(data)
+                    n += len(data)
+                    self.update(url, bytes=n)
+            if (total != None) and (n != total):
+                raise requests.exceptions.ChunkedEncodingError(f'incomplete transfer ({n} of {total} bytes)')
+        os.replace(part, file)
+        p = self.update(url, status='done')
+        stats.add('download', time.time()-p['t1'], n_bytes=n-p['b1'])
+        self.log(f' downloaded {os.path.basename(file)} ({format_bytes(n-p["b1"])} at '+
+                 f'{format_bytes(p["rate"])}/s)')
+        return file
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def update(self, url, **kwargs):
+        with self.lock:
+            p = self.progress.setdefault(url, {'b1':0, 'bytes':0, 'eta':None, 'name':'', 'rate':0.0,
+                                              'status':'queued', 't0':time.time(), 't1':time.time(),
+                                              'total':None, 'url':url})
+            p.update(kwargs)
+            dt = time.time()-p['t1']
+            if (dt > 0):
+                p['rate'] = (p['bytes']-p['b1'])/dt
+            if p['total'] and (p['rate'] > 0):
+                p['eta'] = (p['total']-p['bytes'])/p['rate']
+            p = dict(p)
+        for listener in self.listener:
+            listener(url, p)
+        return p
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # blocks until every queued download is finished and returns the completed files
+    #-
+    def wait(self):
+        with self.lock:
+            futures, self.futures = self.futures, []
+        wait(futures)
+        file = []
+        for future in futures:
+            if future.cancelled():
+                continue
+            if isinstance(future.exception(), download_cancelled):
+                continue
+            if (future.exception() != None):
+                self.log(f'download failed: {future.exception()}')
+            else:
+                file.append(future.result())
+        return file
+
+#--------------------------------------------------------------------------------------------------
+#+
+# file-like wrapper over the response body that reports the bytes read
+#-
+class stream_reader():
+
+    def __init__(self, raw, callback):
+        self.callback = callback
+        self.head = b''
+        self.n = 0
+        self.raw = raw
+
+    def peek(self, n):
+    # the next n bytes, which the following read returns again
+        if (len(self.head) < n):
+            self.head += self.read_raw(n-len(self.head))
+        return self.head[:n]
+
+    def read(self, n=-1):
+        head, self.head = self.head, b''
+        if (n >= 0) and (len(head) >= n):
+            self.head = head[n:]
+            return head[:n]
+        return head+self.read_raw(-1 if (n < 0) else n-len(head))
+
+    def read_raw(self, n):
+        data = self.raw.read(n)
+        self.n += len(data)
+        self.callback(self.n)
+        return data
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+def format_bytes(n):
+    for unit in ['B','KB','MB','GB']:
+        if (abs(n) < 1024):
+            return f'{n:.1f} {unit}'
+        n /= 1024
+    return f'{n:.1f} TB'
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+def format_time(t):
+    t = int(t)
+    return f'{t//3600}:{(t//60)%60:02d}:{t%60:02d}'
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+def get_filename(r, default):
+    base = r.headers.get('Content-Disposition', '')
+    ss = 'filename="'
+    if (base.find(ss) == -1):
+        return default
+    return base[base.find(ss)+len(ss):len(base)-1]
+
+#--------------------------------------------------------------------------------------------------
+#+
+# path of a bundle member under folder, or None for a name that would leave it (absolute, another
+# drive or '..')
+#-
+def get_member_path(folder, name):
+    root = os.path.abspath(folder)
+    file = os.path.abspath(os.path.join(root, name))
+    try:
+        if (os.path.commonpath([root, file]) != root) or (file == root):
+            return None
+    except ValueError: # another drive
+        return None
+    return file
+
+#--------------------------------------------------------------------------------------------------
+#+
+# bytes already received: the size of a partial file, or the saved tar offset of a streamed bundle.
+# the .part file of a stream holds its state ({"mode": "stream", ...}) rather than data, so a part
+# left by the other mode is not resumed.
+#-
+def get_offset(part, streamed=False):
+    if not os.path.exists(part):
+        return 0
+    with open(part, 'rb') as f:
+        is_state = f.read(len(STREAM_STATE)) == STREAM_STATE
+    if not streamed:
+        return 0 if is_state else os.path.getsize(part)
+    if not is_state:
+        return 0
+    try:
+        with open(part, 'r') as f:
+            return json.load(f)['offset']
+    except (ValueError, KeyError):
+        return 0
+
+#--------------------------------------------------------------------------------------------------
+#+
+# stable name for the partial file; M2M urls carry the product id, anything else is hashed
+#-
+def get_id(url):
+    strSearch = 'product_id='
+    pos = url.find(strSearch)
+    if (pos != -1):
+        return (url[pos+len(strSearch):].split('&'))[0]
+    return hashlib.sha1(url.split('?')[0].encode()).hexdigest()[:16]
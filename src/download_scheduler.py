@@ -0,0 +1,148 @@
+import threading
+import time
+
+#--------------------------------------------------------------------------------------------------
+#+
+# polls M2M download-retrieve for downloads that download-request reported as still preparing.
+# each one is handed to on_ready(d_download) as soon as it is available rather than after the whole
+# batch. the interval backs off while nothing new is ready, and polling gives up after timeout.
+#-
+class download_scheduler():
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __init__(self, client, on_ready, backoff=1.5, interval=10.0, log=print, max_interval=120.0,
+                 timeout=3600.0):
+        self.backoff = backoff
+        self.client = client
+        self.interval = interval
+        self.jobs = {}
+        self.listener = []
+        self.lock = threading.Lock()
+        self.log = log
+        self.max_interval = max_interval
+        self.n_ready = 0
+        self.n_total = 0
+        self.on_ready = on_ready
+        self.stop = threading.Event()
+        self.thread = None
+        self.timeout = timeout
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __str__(self):
+        return f'prepared downloads: {self.n_ready}/{self.n_total} ready'
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # queues the preparingDownloads of a download-request made with label and starts polling. a
+    # poller that was cancelled keeps its stop event and winds down; the new one gets its own.
+    #-
+    def add(self, label, preparing):
+        with self.lock:
+            pending = self.jobs.setdefault(label, set())
+            for d_download in preparing:
+                pending.add(d_download['downloadId'])
+            self.n_total += len(preparing)
+            if (self.thread == None) or not self.thread.is_alive() or self.stop.is_set():
+                self.stop = threading.Event()
+                self.thread = threading.Thread(target=self.run, args=(self.stop,), daemon=True)
+                self.thread.start()
+        self.log(f' {len(preparing)} downloads are being prepared ({label})')
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # listener(event, d) is called with 'ready', 'timeout' or 'done' events
+    #-
+    def add_listener(self, listener):
+        self.listener.append(listener)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def cancel(self):
+        with self.lock:
+            self.stop.set()
+            self.drop()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # forgets the downloads still pending (call with the lock held), so a later add does not poll
+    # for them again. returns how many were dropped.
+    #-
+    def drop(self):
+        n = sum(len(pending) for pending in self.jobs.values())
+        self.jobs.clear()
+        self.n_total -= n
+        return n
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def is_busy(self):
+        return (self.thread != None) and self.thread.is_alive()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def notify(self, event, d=None):
+        for listener in self.listener:
+            listener(event, {'ready':self.n_ready, 'total':self.n_total} if (d == None) else d)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # returns the number of downloads that became available
+    #-
+    def poll(self):
+        n = 0
+        with self.lock:
+            labels = [label for label, pending in self.jobs.items() if pending]
+        for label in labels:
+            void, data = self.client.run(self.client.post('download-retrieve', {'label':label}))
+            if not void:
+                continue
+            for d_download in (data.get('available') or []):
+                with self.lock:
+                    pending = self.jobs.get(label, set()) # dropped by a cancel while polling
+                    if d_download.get('downloadId') not in pending:
+                        continue
+                    pending.remove(d_download['downloadId'])
+                    self.n_ready += 1
+                self.on_ready(d_download)
+                self.notify('ready', d_download)
+                n += 1
+        return n
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def run(self, stop):
+        t0 = time.time()
+        interval = self.interval
+        while not stop.is_set():
+            with self.lock:
+                if not any(self.jobs.values()):
+                    break
+            if (time.time()-t0 > self.timeout):
+                with self.lock:
+                    n = self.drop()
+                self.log(f'timed out waiting for {n} prepared downloads ({self})')
+                self.notify('timeout')
+                return None
+            if (self.poll() > 0):
+                self.log(f' {self}')
+                interval = self.interval
+            else:
+                interval = min(self.max_interval, interval*self.backoff)
+            stop.wait(interval)
+        self.notify('done')
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # blocks until every prepared download was handed over (or polling stopped)
+    #-
+    def wait(self):
+        if (self.thread != None):
+            self.thread.join()
@@ -5,9 +5,15 @@ import requests
 import tarfile
 import tempfile
 import threading
+import time
 from calendar import monthrange
-from data_manager import data_manager
 from datetime import datetime
+from download_manager import download_manager
+from download_scheduler import download_scheduler
+from log_sink import log_sink
+from metrics import stats
+from m2m_client import m2m_client
+from response_cache import response_cache
 from urllib.parse import urljoin
 
 #--------------------------------------------------------------------------------------------------
@@ -18,18 +24,19 @@ class landsat():
     api_key = None
     dir_work = None
     name = 'landsat_ot_c2_l2'
-    text_output = None # optional widget ID for writing text (e.g., landsat_viewer)
-    threads = []
     tlb = None
     url = 'https://m2m.cr.usgs.gov/api/api/json/stable/'
     url_download = []
+    url_name = {} # file names of single band downloads, by url
 
     #----------------------------------------------------------------------------------------------
     #+
     #-
-    def __init__(self, uName, token, 
+    def __init__(self, uName, token, bands=None, cache=True, cache_folder=None,
                  cloud_cover=30.0, debug=False, lonlat=[54.199,38.499], month=11,
+                 log_file=None, n_download=4, n_query=8, offline=False, stream_extract=True,
                  working_folder=None, year=2018):
+        self.bands = bands # None downloads the full bundle
         self.cc = cloud_cover
         self.debug = debug
         self.dir_work = os.path.join(os.path.join(tempfile.gettempdir(),'data'),'landsat') \
@@ -37,10 +44,24 @@ class landsat():
         if not os.path.exists(self.dir_work):
             os.mkdir(self.dir_work)
         self.ll = lonlat
+        self.log = log_sink(file=log_file, level='debug' if debug else 'info')
         self.month = month
         self.session = requests.Session()
+        cache = response_cache(folder=cache_folder, log=self.print, offline=offline) if (cache or offline) else None
+        self.client = m2m_client(cache=cache, log=self.print, max_concurrency=n_query, session=self.session)
+        self.downloading = False
+        self.file_name = {}
+        self.listener = []
+        self.lock = threading.Lock()
+        self.scheduler = download_scheduler(self.client, self.add_download, log=self.print)
+        self.stream_extract = stream_extract
+        self.downloader = download_manager(log=self.print, n_workers=n_download, session=self.session)
         self.year = year
-        self.login(uName, token)
+        if offline: # queries are answered from the response cache only
+            self.print('offline: using cached M2M responses')
+            self.api_key = 'offline'
+        else:
+            self.login(uName, token)
         return None
 
     #----------------------------------------------------------------------------------------------
@@ -52,6 +73,37 @@ class landsat():
         else:
             return 'EarthExplorer (not logged in)'
 
+    #----------------------------------------------------------------------------------------------
+    #+
+    # listener.signal_landsat(event, folder) is called from the download threads; the only event
+    # is 'scene_added', published as soon as a scene's files are on disk
+    #-
+    def add_listener(self, listener):
+        self.listener.append(listener)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # takes an available download record; it is queued right away when downloads are running
+    #-
+    def add_download(self, d_download):
+        url = d_download['url']
+        for key in ['entityId','productId']:
+            if (d_download.get(key) in self.file_name):
+                self.url_name[url] = self.file_name[d_download[key]]
+        with self.lock:
+            self.url_download.append(url)
+            if self.downloading:
+                self.download(url)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # stops the running search/download job; partial downloads are resumed by the next one
+    #-
+    def cancel(self):
+        self.print('cancelling downloads...')
+        self.scheduler.cancel()
+        self.downloader.cancel()
+
     #----------------------------------------------------------------------------------------------
     #+
     #-
@@ -59,30 +111,55 @@ class landsat():
         void, dirOut = self.is_valid_url(url)
         if not void:
             return None
+        if (url in self.url_name): # a single band file rather than a bundle
+            if os.path.exists(os.path.join(dirOut, self.url_name[url])):
+                return None
+            if (use_threads == True):
+                return self.downloader.submit(url, dirOut, on_done=lambda f: self.scene_added(dirOut))
+            self.downloader.download(url, dirOut)
+            return self.scene_added(dirOut)
         fileCurrent = os.listdir(dirOut)
-        if (len(fileCurrent) != 0):
-            self.print(f'output folder is not empty: {dirOut}')
+        partial = [f for f in fileCurrent if (os.path.splitext(f)[1] == '.part')]
+        if (len(fileCurrent) != 0) and (len(partial) == 0):
+            self.print(f'output folder is not empty: {dirOut}', level='warning')
             if (len(fileCurrent) == 1): # this may be a downloaded TAR file. try to extract its contents
                 self.extract_tar(os.path.join(dirOut,fileCurrent[0]))
+                self.scene_added(dirOut)
             return None
         if (use_threads == True):
-            thread = threading.Thread(target=self.download_thread, args=(url,dirOut))
-            self.threads.append(thread)
-            thread.start()
+            if self.stream_extract:
+                return self.downloader.submit(url, dirOut, extract=self.is_band_file,
+                                              on_done=lambda f: self.scene_added(dirOut))
+            def on_done(file):
+                self.extract_tar(file)
+                self.scene_added(dirOut)
+            return self.downloader.submit(url, dirOut, on_done=on_done)
         else:
             self.download_thread(url, dirOut)
 
     #----------------------------------------------------------------------------------------------
     #+
     #-
-    def download_all(self, url=None, use_threads=True):
+    def download_all(self, url=None, use_threads=True, bands=None):
         urlAll = self.url_download if (url == None) else url
-        if (len(urlAll) == 0):
+        if (bands != None): # keep only the band files of a band-selective query that are wanted
+            urlAll = [u for u in urlAll if (u not in self.url_name) or self.is_selected_band(self.url_name[u], bands)]
+        if (len(urlAll) == 0) and not self.scheduler.is_busy():
             return None
-        for url_download in urlAll:
-            self.download(url_download, use_threads=use_threads)
-        for thread in self.threads:
-            thread.join()
+        with self.lock:
+            self.downloading = use_threads
+            for url_download in urlAll:
+                self.download(url_download, use_threads=use_threads)
+    # downloads still being prepared are queued by the scheduler as they become available
+        self.scheduler.wait()
+        with self.lock:
+            self.downloading = False
+        if not use_threads:
+            for url_download in self.url_download:
+                if url_download not in urlAll:
+                    self.download(url_download, use_threads=False)
+        self.downloader.wait()
+        self.print(f'downloads: {self.downloader}')
 
     #----------------------------------------------------------------------------------------------
     #+
@@ -92,15 +169,12 @@ class landsat():
             void, output_folder = self.is_valid_url(url)
             if (void == False): # This shouldn't happen
                 return None
-        r = requests.get(url, stream=True)
-        base = r.headers['Content-Disposition']
-        ss = 'filename="'
-        base = base[base.find(ss)+len(ss):len(base)-1]
-        file = os.path.join(output_folder, base)
-        with open(file, 'wb') as f:
-            for data in r.iter_content(chunk_size=8192):
-                f.write(data)
-        self.extract_tar(file)
+        if self.stream_extract:
+            self.downloader.download(url, output_folder, extract=self.is_band_file)
+        else:
+            file = self.downloader.download(url, output_folder)
+            self.extract_tar(file)
+        self.scene_added(output_folder)
         return None
 
     #----------------------------------------------------------------------------------------------
@@ -111,21 +185,21 @@ class landsat():
             return None
         dir = os.path.dirname(file)
         try:
+            t0 = time.perf_counter()
+            n_bytes = os.path.getsize(file)
             tar = tarfile.open(file, 'r')
             print('extracting files...')
-            regex = re.compile('_B.')
             for m in tar.getmembers():
-                if (os.path.splitext(m.name)[1].lower() == '.tif'):
-                    ms = regex.search(m.name)
-                    if (ms != None):
-                        if not os.path.exists(os.path.join(dir, m.name)):
-                            print(f' {m.name}')
-                            tar.extract(m, path=dir)
+                if self.is_band_file(m.name):
+                    if not os.path.exists(os.path.join(dir, m.name)):
+                        print(f' {m.name}')
+                        tar.extract(m, path=dir)
             tar.close()
+            stats.add('extract', time.perf_counter()-t0, n_bytes=n_bytes)
             if delete_tar:
                 os.remove(file)
         except:
-            self.print(f'not a valid TAR file: {file}')
+            self.print(f'not a valid TAR file: {file}', level='error')
             return None
 
     #----------------------------------------------------------------------------------------------
@@ -145,13 +219,22 @@ class landsat():
     def get_working_folder(self):
         return self.dir_work
 
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def is_band_file(self, name):
+    # band images, plus the MTL metadata the scene catalog reads the cloud cover from
+        if name.upper().endswith('_MTL.TXT'):
+            return True
+        return (os.path.splitext(name)[1].lower() == '.tif') and (re.search('_B.', name) != None)
+
     #----------------------------------------------------------------------------------------------
     #+
     #-
     def is_valid_url(self, url):
-        id = self.get_id_from_url(url)
+        id = self.url_name.get(url, self.get_id_from_url(url))
         if (len(id) == 0):
-            self.print(f'invalid url {url}')
+            self.print(f'invalid url {url}', level='error')
             return False, ''
         tok = id.split('_')
         dirOut = self.dir_work
@@ -174,9 +257,10 @@ class landsat():
         j = r.json()
         if j.get('errCode') or j.get('errorCode'):
             if (self.debug):
-                self.print(' failed to set API key')
+                self.print(' failed to set API key', level='error')
             return None
         self.api_key = j.get('data')
+        self.client.api_key = self.api_key
 
     #----------------------------------------------------------------------------------------------
     #+
@@ -185,46 +269,63 @@ class landsat():
         self.print('logging out...')
         void, data = self.post('logout', None)
         self.session = requests.Session()
+        self.client.set_session(self.session)
+        self.downloader.session = self.session
         self.api_key = None
+        self.client.api_key = None
 
     #----------------------------------------------------------------------------------------------
     #+
     #-
     def post(self, ep, d_post, header=None, quiet=None):
-        url = urljoin(self.url,ep)
-        r = self.session.post(url,json.dumps(d_post),headers=header)
-        j = r.json()
-        if (j.get('errorCode') != None):
-            if (quiet != None):
-                self.print(url+'\n '+j.get('errorMessage'))
-            return (False, [])
-        data = j.get('data')
-        return (True, data)
+        return self.client.run(self.client.post(ep, d_post, header=header, quiet=quiet))
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def print(self, s, level='info'):
+        self.log.write(s, level=level)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # date used to order scenes (e.g. '2018-11-18')
+    #-
+    def get_scene_date(self, result):
+        coverage = result.get('temporalCoverage') or {}
+        if coverage.get('startDate'):
+            return coverage['startDate'][:10]
+        tok = result['displayId'].split('_')
+        return f'{tok[3][0:4]}-{tok[3][4:6]}-{tok[3][6:8]}' if (len(tok) > 3) else ''
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # location is a point [lon,lat] or a bounding box [lon_min,lat_min,lon_max,lat_max]
+    #-
+    def get_spatial_filter(self, location):
+        ll = location if (len(location) == 4) else [location[0], location[1], location[0], location[1]]
+        return {'filterType':'mbr',
+                'lowerLeft':{'latitude' : ll[1], 'longitude' : ll[0]},
+                'upperRight':{ 'latitude' : ll[3], 'longitude' : ll[2]}}
 
     #----------------------------------------------------------------------------------------------
     #+
     #-
-    def print(self,s):
-        if (self.text_output != None):
-            t = self.text_output.toPlainText()
-            t += '\n'+s
-            n = t.count('\n')
-            self.text_output.setText(t)
-            qScroll = self.text_output.verticalScrollBar()
-            qScroll.setValue(len(t))
-            self.text_output.repaint()
-        print(s)
+    def is_selected_band(self, name, bands):
+        return any(re.search(f'_{band}\\.TIF$', name, re.IGNORECASE) for band in bands)
 
     #----------------------------------------------------------------------------------------------
     #+
     #-
-    def query(self, cloud_cover=None, dataset_name=None, lonlat=None,
+    def query(self, bands=None, cloud_cover=None, dataset_name=None, lonlat=None,
               max_return=None, month=None, year=None):
         if (self.api_key == None):
-            self.print('Not logged into USGS M2M')
+            self.print('Not logged into USGS M2M', level='error')
             return None
         self.url_download = [] # clear any results from previous search
+        self.url_name = {}
+        self.file_name = {}
     # input parameters
+        bands = self.bands if (bands == None) else bands
         cc = self.cc if (cloud_cover == None) else cloud_cover
         ll = self.ll if (lonlat == None) else lonlat
         m = self.month if (month == None) else month
@@ -244,17 +345,22 @@ class landsat():
         void, data = self.post('dataset-search', d_post, header=d_header)
         if not void:
             return None
+        dataset = []
         for d_data in data:
             if (name != d_data['datasetAlias']):
                 self.print(' skipping')
                 continue
+            dataset.append(d_data)
+        d_post = {'datasetName':name,
+                    'maxResults':nMax,
+                    'sceneFilter':{'spatialFilter':d_spatial,
+                                   'acquisitionFilter':d_temporal},
+                    'startingNumber':1}
+    # the scene searches of all datasets run concurrently
+        d_result = self.client.run(self.client.gather(
+            *[self.client.scene_search(d_post, header=d_header) for d_data in dataset]))
+        for d_data, (void, d_scene) in zip(dataset, d_result):
             self.print(f'{d_data["collectionName"]}')
-            d_post = {'datasetName':name,
-                        'maxResults':nMax,
-                        'sceneFilter':{'spatialFilter':d_spatial,
-                                       'acquisitionFilter':d_temporal},
-                        'startingNumber':1}
-            void, d_scene = self.post('scene-search',d_post, header=d_header)
             if not void:
                 continue
             if (len(d_scene) == 0):
@@ -274,32 +380,106 @@ class landsat():
             if (len(scene) == 0):
                 self.print('no scenes to download')
                 continue
-            d_post = {'datasetName':d_data['datasetAlias'], 'entityIds':scene}
-            void, option = self.post('download-options',d_post, header=d_header)
-            if not void:
+            self.request_downloads(d_data['datasetAlias'], scene, bands=bands, header=d_header)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def scene_added(self, folder):
+        for listener in self.listener:
+            listener.signal_landsat('scene_added', folder)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # searches every location over the date range, paging through all results with startingNumber.
+    # the first page of every location is requested concurrently, then all remaining pages. scenes
+    # found by several (overlapping) locations are kept once, and the merged list, sorted by date,
+    # is requested for download in one pass. returns the scene list.
+    #-
+    def query_batch(self, start, end, bands=None, boxes=None, cloud_cover=None, dataset_name=None,
+                    page_size=100, points=None):
+        if (self.api_key == None):
+            self.print('Not logged into USGS M2M', level='error')
+            return None
+        self.url_download = [] # clear any results from previous search
+        self.url_name = {}
+        self.file_name = {}
+        bands = self.bands if (bands == None) else bands
+        cc = self.cc if (cloud_cover == None) else cloud_cover
+        name = self.name if (dataset_name == None) else dataset_name
+        location = list(points or [])+list(boxes or [])
+        self.print(f'querying:\n {len(location)} locations\n dates: {start} to {end}')
+        def get_post(loc, first):
+            return {'datasetName':name,
+                    'maxResults':page_size,
+                    'sceneFilter':{'spatialFilter':self.get_spatial_filter(loc),
+                                   'acquisitionFilter':{'start':str(start), 'end':str(end)},
+                                   'cloudCoverFilter':{'min':0, 'max':cc}},
+                    'startingNumber':first}
+        async def search():
+            page = await self.client.gather(*[self.client.scene_search(get_post(loc, 1)) for loc in location])
+            post = []
+            for loc, (void, d_scene) in zip(location, page):
+                if void and d_scene:
+                    for first in range(1+page_size, d_scene['totalHits']+1, page_size):
+                        post.append(get_post(loc, first))
+            self.print(f' {len(location)+len(post)} pages')
+            return page + await self.client.gather(*[self.client.scene_search(d_post) for d_post in post])
+        scene = {}
+        for void, d_scene in self.client.run(search()):
+            if not (void and d_scene):
                 continue
-        # download request
-            download = []
-            for d_option in option:
+            for result in d_scene['results']:
+                if (result['cloudCover'] > cc):
+                    continue
+                scene[result['entityId']] = result
+        scene = sorted(scene.values(), key=lambda result: (self.get_scene_date(result), result['displayId']))
+        self.print(f'{len(scene)} scenes')
+        for result in scene:
+            self.print(f' {result["displayId"]} ({result["cloudCover"]})')
+        for i in range(0, len(scene), page_size):
+            self.request_downloads(name, [result['entityId'] for result in scene[i:i+page_size]], bands=bands)
+        return scene
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # requests the downloads of the scenes and adds the urls to url_download. with a band list (e.g.
+    # ['B6','B7']) only the matching per-band files offered as secondary downloads are requested
+    # instead of the full bundle.
+    #-
+    def request_downloads(self, dataset_name, scene, bands=None, header=None):
+        d_post = {'datasetName':dataset_name, 'entityIds':scene}
+        void, option = self.post('download-options',d_post, header=header)
+        if not void:
+            return None
+    # download request
+        download = []
+        name = self.file_name
+        for d_option in option:
+            if not bands:
                 if (d_option['available']):
                     download.append({'entityId' : d_option['entityId'],
                                     'productId' : d_option['id']})
-            if not download:
-                self.print('no files to download')
-                continue
-            n_download = len(download)
-            label = datetime.now().strftime("%Y%m%d_%H%M%S")
-            d_post = {'downloads':download, 'label':label}
-            void, d_request = self.post('download-request', d_post, header=d_header)
-            if not void:
-                continue
-            if (d_request['preparingDownloads'] == None) or (len(d_request['preparingDownloads']) == 0):
-            
-                for d_download in d_request['availableDownloads']:
-                    self.url_download.append(d_download['url'])
-            else:
-                print('not implemented yet')
                 continue
+            for d_file in (d_option.get('secondaryDownloads') or []):
+                if d_file['available'] and self.is_selected_band(d_file['displayId'], bands):
+                    download.append({'entityId' : d_file['entityId'],
+                                    'productId' : d_file['id']})
+                    name[d_file['entityId']] = name[d_file['id']] = d_file['displayId']
+        if not download:
+            self.print('no files to download')
+            return None
+        if bands:
+            self.print(f' {len(download)} band files ({",".join(bands)})')
+        label = datetime.now().strftime("%Y%m%d_%H%M%S_%f") # unique per request, for download-retrieve
+        d_post = {'downloads':download, 'label':label}
+        void, d_request = self.post('download-request', d_post, header=header)
+        if not void:
+            return None
+        for d_download in d_request['availableDownloads']:
+            self.add_download(d_download)
+        if d_request['preparingDownloads']:
+            self.scheduler.add(label, d_request['preparingDownloads'])
 
 #--------------------------------------------------------------------------------------------------
 #+
@@ -2,23 +2,30 @@ import argparse
 import json
 import os
 import sys
-import tkinter as tk
+import threading
 from data_manager import data_manager
 from data_view import data_view
 from datetime import datetime
+from download_manager import format_bytes, format_time
 from ee import landsat
-from login_dialog import *
+from metrics import stats
 from PyQt6 import QtCore, QtGui, QtWidgets
 from pathlib import Path
-from tkinter import simpledialog
+from time_series_view import time_series_view
 
 #--------------------------------------------------------------------------------------------------
 #+
 #-
 class landsat_viewer(QtWidgets.QWidget):
 
+    signal_data_loaded = QtCore.pyqtSignal(object, object)
+    signal_job_done = QtCore.pyqtSignal()
+    signal_scene_added = QtCore.pyqtSignal(str)
+    signal_series_ready = QtCore.pyqtSignal(object)
+    signal_stack_progress = QtCore.pyqtSignal(int, int)
+
     _pr = None
-    app = QtWidgets.QApplication(sys.argv)
+    job = None
     file_login = None
 
     #----------------------------------------------------------------------------------------------
@@ -26,7 +33,9 @@ class landsat_viewer(QtWidgets.QWidget):
     #-
     def __init__(self, cloud_cover=None, debug=False, lonlat=None, login_file=None,
                  parent=None, save_login=False, token=None, uname=None, working_folder=None):
+        app = get_app() # a widget needs the application, which is made on first use only
         super().__init__(parent)
+        self.app = app
         if (uname == None or token == None):
             uname, token, save_login = self.get_login(file_login=login_file)
         self.api = landsat(uname, token,
@@ -36,25 +45,91 @@ class landsat_viewer(QtWidgets.QWidget):
             self.save_login(uname, token)
         self.dm = data_manager(working_folder=self.api.dir_work)
         self.dm.add_listener(self)
+        self.api.add_listener(self)
+        self.signal_data_loaded.connect(self.show_data)
+        self.signal_job_done.connect(self.event_job_done)
+        self.signal_scene_added.connect(self.dm.add_scene)
+        self.signal_series_ready.connect(self.show_series)
+        self.signal_stack_progress.connect(self.show_stack_progress)
         self.gui()
 
     #----------------------------------------------------------------------------------------------
     #+
     #-
     def dialog_get_login(self):
-        # root = tk.Tk()
-        # root.withdraw()
+        from login_dialog import get_ee_login # tkinter is only loaded when there is no saved login
         uname, pwd, save = get_ee_login()
         return uname, pwd, save
 
     #----------------------------------------------------------------------------------------------
     #+
     #-
-    def event_download(self, event):
+    def event_cancel(self, event=None):
+        if (self.job != None) and self.job.is_alive():
+            self.api.cancel()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # the search and the downloads run on a background thread so the window (and the Display tab)
+    # stays responsive; progress is read from the download manager by a timer
+    #-
+    def event_download(self, event=None):
+        if (self.job != None) and self.job.is_alive():
+            return None
         ll = [float(self.qLL[0].text()),float(self.qLL[1].text())]
-        self.api.query(lonlat=ll, month=int(self.text_date[0].text()), year=int(self.text_date[1].text()))
-        self.api.download_all()
-        self.dm.parse()
+        m, y = int(self.text_date[0].text()), int(self.text_date[1].text())
+        self.api.downloader.reset()
+        self.table_progress.setRowCount(0)
+        self.row_progress = {}
+        self.button_download.setEnabled(False)
+        self.button_cancel.setEnabled(True)
+        def run():
+            try:
+                self.api.query(lonlat=ll, month=m, year=y)
+                if not self.api.downloader.cancelled.is_set():
+                    self.api.download_all()
+            except Exception as e:
+                self.api.print(f'download failed: {e}')
+            self.signal_job_done.emit()
+        self.job = threading.Thread(target=run, daemon=True)
+        self.job.start()
+        self.timer_progress.start()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def event_job_done(self):
+        self.timer_progress.stop()
+        self.update_progress()
+        self.button_download.setEnabled(True)
+        self.button_cancel.setEnabled(False)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def event_metrics_dump(self):
+        file, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Save metrics', 'metrics.json', 'JSON (*.json)')
+        if file:
+            stats.to_json(file)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def event_metrics_reset(self):
+        stats.reset()
+        self.update_metrics()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # cProfile only sees the GUI thread; the worker stages show up in the timers instead
+    #-
+    def event_profile(self, on):
+        if on:
+            stats.start_profile()
+            return None
+        file, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Save profile', 'profile.prof', 'Profile (*.prof)')
+        self.text_profile = stats.stop_profile(file=file if file else None)
+        self.update_metrics()
 
     #----------------------------------------------------------------------------------------------
     #+
@@ -62,6 +137,12 @@ class landsat_viewer(QtWidgets.QWidget):
     def event_open(self):
         self.load_from_dm()
 
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def event_stack_cancel(self):
+        self.dm.cancel_stack()
+
     #----------------------------------------------------------------------------------------------
     #+
     #-
@@ -89,6 +170,7 @@ class landsat_viewer(QtWidgets.QWidget):
         tlb.addWidget(self.tab)
         self.gui_display()
         self.gui_download()
+        self.gui_metrics()
         self.setLayout(tlb)
         self.show()
         sys.exit(self.app.exec())
@@ -117,6 +199,16 @@ class landsat_viewer(QtWidgets.QWidget):
         layoutDM.addLayout(layoutBottom)
         layoutBottom.addWidget(self.buttonAuto)
         layoutBottom.addWidget(self.buttonOpen)
+    # the stack statistics job an anomaly waits for
+        self.progress_stack = QtWidgets.QProgressBar(self)
+        self.progress_stack.setFormat('stack %p%')
+        self.button_stack_cancel = QtWidgets.QPushButton('Cancel', self)
+        self.button_stack_cancel.clicked.connect(self.event_stack_cancel)
+        layoutStack = QtWidgets.QHBoxLayout()
+        layoutDM.addLayout(layoutStack)
+        layoutStack.addWidget(self.progress_stack)
+        layoutStack.addWidget(self.button_stack_cancel)
+        self.show_stack_progress(0, 0)
     # display
         layoutDV = QtWidgets.QVBoxLayout()
         layoutH.addLayout(layoutDV)
@@ -132,6 +224,19 @@ class landsat_viewer(QtWidgets.QWidget):
         layoutDV = QtWidgets.QVBoxLayout(baseDV)
         layoutDV.addWidget(self.viewer)
         layoutDV.addWidget(self.labelCoords)
+    # pixel-drill time series of the last clicked pixel
+        self.series_view = time_series_view(baseDV)
+        self.series_view.setFixedHeight(180)
+        self.series_view.signal_date_selected.connect(self.select_date)
+        layoutDV.addWidget(self.series_view)
+        layoutSeries = QtWidgets.QHBoxLayout()
+        layoutSeries.addWidget(QtWidgets.QLabel('Series:'), alignment=QtCore.Qt.AlignmentFlag.AlignRight)
+        self.comboSeries = QtWidgets.QComboBox(baseDV)
+        self.comboSeries.addItems(['methane','B6','B7'])
+        self.comboSeries.currentTextChanged.connect(self.series_view.set_key)
+        layoutSeries.addWidget(self.comboSeries)
+        layoutSeries.setAlignment(QtCore.Qt.AlignmentFlag.AlignRight)
+        layoutDV.addLayout(layoutSeries)
 
     def gui_download(self):
         tlb = QtWidgets.QWidget()
@@ -143,8 +248,25 @@ class landsat_viewer(QtWidgets.QWidget):
         self.text_output.ensureCursorVisible = True
         self.text_output.setReadOnly = True
         self.text_output.resize(500,500)
-        self.api.text_output = self.text_output
+        self.api.log.set_widget(self.text_output)
+        self.timer_log = QtCore.QTimer(self)
+        self.timer_log.setInterval(100) # at most ten widget updates a second
+        self.timer_log.timeout.connect(self.api.log.flush)
+        self.timer_log.start()
         layout.addWidget(self.text_output)
+    # download progress
+        self.table_progress = QtWidgets.QTableWidget(0, 6, self)
+        self.table_progress.setHorizontalHeaderLabels(['File','Status','Size','Progress','Rate','ETA'])
+        self.table_progress.horizontalHeader().setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeMode.Stretch)
+        self.table_progress.verticalHeader().setVisible(False)
+        self.table_progress.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.table_progress)
+        self.label_progress = QtWidgets.QLabel(self)
+        layout.addWidget(self.label_progress)
+        self.row_progress = {}
+        self.timer_progress = QtCore.QTimer(self)
+        self.timer_progress.setInterval(250)
+        self.timer_progress.timeout.connect(self.update_progress)
     # bottom base
         layout_bottom = QtWidgets.QHBoxLayout()
     # month/year
@@ -171,10 +293,52 @@ class landsat_viewer(QtWidgets.QWidget):
             qLL.setFixedWidth(50)
             layout_ll.addWidget(qLL)
         layout_bottom.addLayout(layout_ll)
-        button = QtWidgets.QPushButton("Download", self)
-        button.setFixedWidth(70)
-        button.mousePressEvent = self.event_download
-        layout_bottom.addWidget(button)
+        self.button_download = QtWidgets.QPushButton("Download", self)
+        self.button_download.setFixedWidth(70)
+        self.button_download.clicked.connect(self.event_download)
+        layout_bottom.addWidget(self.button_download)
+        self.button_cancel = QtWidgets.QPushButton("Cancel", self)
+        self.button_cancel.setFixedWidth(70)
+        self.button_cancel.setEnabled(False)
+        self.button_cancel.clicked.connect(self.event_cancel)
+        layout_bottom.addWidget(self.button_cancel)
+        layout_bottom.setAlignment(QtCore.Qt.AlignmentFlag.AlignRight)
+        layout.addLayout(layout_bottom)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # stage timings and counters from metrics.stats, refreshed while the tab is showing
+    #-
+    def gui_metrics(self):
+        tlb = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout()
+        tlb.setLayout(layout)
+        self.tab.addTab(tlb, 'Metrics')
+        self.text_profile = ''
+        self.text_metrics = QtWidgets.QPlainTextEdit(self)
+        self.text_metrics.setReadOnly(True)
+        self.text_metrics.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.SystemFont.FixedFont))
+        layout.addWidget(self.text_metrics)
+        self.timer_metrics = QtCore.QTimer(self)
+        self.timer_metrics.setInterval(1000)
+        self.timer_metrics.timeout.connect(self.update_metrics)
+        self.timer_metrics.start()
+    # bottom base
+        layout_bottom = QtWidgets.QHBoxLayout()
+        self.check_memory = QtWidgets.QCheckBox('Trace memory', self)
+        self.check_memory.toggled.connect(stats.set_memory_tracing)
+        layout_bottom.addWidget(self.check_memory)
+        self.check_profile = QtWidgets.QCheckBox('Profile', self)
+        self.check_profile.toggled.connect(self.event_profile)
+        layout_bottom.addWidget(self.check_profile)
+        button_reset = QtWidgets.QPushButton('Reset', self)
+        button_reset.setFixedWidth(70)
+        button_reset.clicked.connect(self.event_metrics_reset)
+        layout_bottom.addWidget(button_reset)
+        button_dump = QtWidgets.QPushButton('Dump JSON', self)
+        button_dump.setFixedWidth(90)
+        button_dump.clicked.connect(self.event_metrics_dump)
+        layout_bottom.addWidget(button_dump)
         layout_bottom.setAlignment(QtCore.Qt.AlignmentFlag.AlignRight)
         layout.addLayout(layout_bottom)
 
@@ -182,10 +346,9 @@ class landsat_viewer(QtWidgets.QWidget):
     #+
     #-
     def load_from_dm(self):
-        pixmap = self.dm.get_data()
-        pr = self.dm.get_pr()
-        self.viewer.set_data(pixmap, reset=(pr != self._pr))
-        self._pr = pr
+    # decoding runs on the data manager's worker pool; the signals bring the result (and the progress
+    # of a stack build the anomaly waits for) back to the GUI thread
+        self.dm.get_data_async(self.signal_data_loaded.emit, progress=self.signal_stack_progress.emit)
 
     #----------------------------------------------------------------------------------------------
     #+
@@ -202,8 +365,42 @@ class landsat_viewer(QtWidgets.QWidget):
     #+
     #-
     def select_coords(self, point):
+    # the drill runs on the data manager's pool; the signal brings the series back to the GUI thread
         if not point.isNull():
-            ll, xyMap = self.dm.get_data_coords((point.x(), point.y()))
+            self.dm.pixel_series_async(self.signal_series_ready.emit, point.x(), point.y())
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def select_date(self, dt):
+        items = self.dm.listDT.findItems(dt, QtCore.Qt.MatchFlag.MatchExactly)
+        if (len(items) > 0):
+            self.dm.listDT.setCurrentItem(items[0])
+            self.load_from_dm()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def show_data(self, data, pr):
+        self.viewer.set_data(data, reset=(pr != self._pr))
+        self._pr = pr
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def show_series(self, series):
+        self.series_view.set_series(series)
+        self.comboSeries.setCurrentText(self.series_view.key)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # shown while a stack statistics job runs; (0, 0) when it ended
+    #-
+    def show_stack_progress(self, done, total):
+        self.progress_stack.setRange(0, max(1, total))
+        self.progress_stack.setValue(done)
+        self.progress_stack.setVisible(total > 0)
+        self.button_stack_cancel.setVisible(total > 0)
 
     #----------------------------------------------------------------------------------------------
     #+
@@ -213,6 +410,14 @@ class landsat_viewer(QtWidgets.QWidget):
             return None
         self.load_from_dm()
 
+    #----------------------------------------------------------------------------------------------
+    #+
+    # called from the download threads; the signal moves the catalog update to the GUI thread
+    #-
+    def signal_landsat(self, event, folder):
+        if (event == 'scene_added'):
+            self.signal_scene_added.emit(folder)
+
     #----------------------------------------------------------------------------------------------
     #+
     #-
@@ -225,6 +430,38 @@ class landsat_viewer(QtWidgets.QWidget):
         else:
             self.labelCoords.clear()
 
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def update_progress(self):
+        for url, p in self.api.downloader.get_progress().items():
+            if url not in self.row_progress:
+                self.row_progress[url] = self.table_progress.rowCount()
+                self.table_progress.insertRow(self.row_progress[url])
+            pct = f'{100*p["bytes"]/p["total"]:.0f}%' if p['total'] else format_bytes(p['bytes'])
+            rate = f'{format_bytes(p["rate"])}/s' if (p['status'] == 'downloading') else ''
+            eta = format_time(p['eta']) if (p['eta'] != None) and (p['status'] == 'downloading') else ''
+            size = format_bytes(p['total']) if p['total'] else ''
+            for i, text in enumerate([p['name'], p['status'], size, pct, rate, eta]):
+                self.table_progress.setItem(self.row_progress[url], i, QtWidgets.QTableWidgetItem(text))
+        self.label_progress.setText(f'{self.api.downloader}  ({self.api.scheduler})')
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def update_metrics(self):
+        if (self.tab.currentIndex() != self.tab.count()-1):
+            return None
+        self.text_metrics.setPlainText(f'{stats}\n\n{self.dm.cache}\n\n{self.text_profile}')
+
+#--------------------------------------------------------------------------------------------------
+#+
+# the application is made on first use, never at import: spawned worker processes (the stack
+# statistics and batch render pools) re-import this module as __mp_main__ and must not open one
+#-
+def get_app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+
 #--------------------------------------------------------------------------------------------------
 #+
 #-
@@ -250,6 +487,7 @@ def test_landsat_viewer():
 #-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", type=str, default=None, help="run the job file headless (see batch.py) and exit")
     parser.add_argument("--cloud_cover", type=float, default=50.0, help="maximum cloud cover percent allowed")
     parser.add_argument("--lat", type=float, default=38.499, help="default longitude")
     parser.add_argument("--lon", type=float, default=54.199, help="default latitude")
@@ -257,5 +495,9 @@ if __name__ == '__main__':
     parser.add_argument("--uname", type=str, default=None, help="EarthExplorer username")
     parser.add_argument("--working_folder", type=str, default="C:\\data\\landsat")
     args = parser.parse_args()
-    main(args)
+    if (args.batch != None):
+        from batch import load_job, run
+        run(load_job(args.batch))
+    else:
+        main(args)
 
@@ -0,0 +1,97 @@
+import logging
+import logging.handlers
+import threading
+from collections import deque
+
+LEVELS = {'debug':logging.DEBUG, 'info':logging.INFO, 'warning':logging.WARNING, 'error':logging.ERROR}
+
+#--------------------------------------------------------------------------------------------------
+#+
+# thread-safe log with levels. lines are kept in a bounded ring buffer and queued for the text
+# widget, which is only touched by flush(); the gui calls it from a timer, so however fast lines
+# arrive the widget gets at most one append per tick. lines can also be mirrored to a rotating file.
+#-
+class log_sink():
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __init__(self, capacity=10000, echo=True, file=None, file_bytes=5*2**20, file_count=3,
+                 level='info'):
+        self.buffer = deque(maxlen=capacity)
+        self.capacity = capacity
+        self.echo = echo
+        self.level = LEVELS[level]
+        self.lock = threading.Lock()
+        self.logger = None
+        self.n_dropped = 0
+        self.pending = deque(maxlen=capacity)
+        self.widget = None
+        if (file != None):
+            self.set_file(file, file_bytes=file_bytes, file_count=file_count)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # appends the queued lines to the widget in one call; run on the widget's (gui) thread
+    #-
+    def flush(self):
+        if (self.widget == None):
+            return 0
+        with self.lock:
+            lines = list(self.pending)
+            self.pending.clear()
+            n_dropped, self.n_dropped = self.n_dropped, 0
+        if n_dropped:
+            lines.insert(0, f'... {n_dropped} lines not shown')
+        if lines:
+            self.widget.append('\n'.join(lines))
+        return len(lines)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_lines(self):
+        with self.lock:
+            return list(self.buffer)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def set_file(self, file, file_bytes=5*2**20, file_count=3):
+        self.logger = logging.getLogger(f'{__name__}.{id(self)}')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        handler = logging.handlers.RotatingFileHandler(file, backupCount=file_count, maxBytes=file_bytes)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+        self.logger.addHandler(handler)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def set_level(self, level):
+        self.level = LEVELS[level]
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # widget is a QTextEdit (anything with append); its document is bounded to the ring size
+    #-
+    def set_widget(self, widget):
+        self.widget = widget
+        widget.document().setMaximumBlockCount(self.capacity)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def write(self, s, level='info'):
+        if (LEVELS[level] < self.level):
+            return None
+        line = s if (level == 'info') else f'{level.upper()}: {s}'
+        with self.lock:
+            self.buffer.append(line)
+            if (len(self.pending) == self.pending.maxlen):
+                self.n_dropped += 1
+            self.pending.append(line)
+        if (self.logger != None):
+            self.logger.log(LEVELS[level], s)
+        if self.echo:
+            print(line)
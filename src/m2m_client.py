@@ -0,0 +1,142 @@
+import asyncio
+import json
+import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from metrics import stats
+from requests.adapters import HTTPAdapter
+from urllib.parse import urljoin
+
+#--------------------------------------------------------------------------------------------------
+#+
+# asyncio client for the USGS M2M json api. requests are sent on a shared session whose connection
+# pool is sized to the concurrency limit, so calls reuse kept-alive connections, and at most
+# max_concurrency of them are in flight at once. the blocking session calls run on worker threads.
+# the client has one event loop, running on its own thread for as long as the client exists, so
+# synchronous callers on any thread (or inside another loop) share it rather than making a loop
+# per request.
+#-
+class m2m_client():
+
+    api_key = None
+    url = 'https://m2m.cr.usgs.gov/api/api/json/stable/'
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __init__(self, api_key=None, cache=None, log=print, max_concurrency=8, session=None, timeout=60):
+        self.api_key = api_key
+        self.cache = cache
+        self.lock = threading.Lock()
+        self.log = log
+        self.loop = None
+        self.max_concurrency = max_concurrency
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.timeout = timeout
+        self.set_session(requests.Session() if (session == None) else session)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    async def dataset_search(self, d_post, **kwargs):
+        return await self.post('dataset-search', d_post, **kwargs)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    async def download_options(self, d_post, **kwargs):
+        return await self.post('download-options', d_post, **kwargs)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    async def download_request(self, d_post, **kwargs):
+        return await self.post('download-request', d_post, **kwargs)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # runs the coroutines concurrently (within the concurrency limit) and returns their results in order
+    #-
+    async def gather(self, *coroutine):
+        return await asyncio.gather(*coroutine)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # the client's event loop, started on its own thread on first use
+    #-
+    def get_loop(self):
+        with self.lock:
+            if (self.loop == None):
+                self.loop = asyncio.new_event_loop()
+                self.loop.set_default_executor(ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                                  thread_name_prefix='m2m'))
+                threading.Thread(target=self.loop.run_forever, name='m2m loop', daemon=True).start()
+            return self.loop
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_header(self, header=None):
+        if (header != None):
+            return header
+        return None if (self.api_key == None) else {'X-Auth-Token':self.api_key}
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # returns (True, data) or (False, []) like landsat.post
+    #-
+    async def post(self, ep, d_post, header=None, quiet=None):
+        url = urljoin(self.url,ep)
+        if (self.cache != None):
+            response = self.cache.get(ep, d_post)
+            if (response != None):
+                stats.count('query cache hit')
+                return response
+            if self.cache.offline:
+                self.log(f' offline: no cached response for {ep}')
+                return (False, [])
+        with stats.timer(f'query {ep}'):
+            r = await asyncio.to_thread(self.send, url, json.dumps(d_post), self.get_header(header))
+        j = r.json()
+        if (j.get('errorCode') != None):
+            if (quiet != None):
+                self.log(url+'\n '+j.get('errorMessage'))
+            return (False, [])
+        if (self.cache != None):
+            self.cache.put(ep, d_post, (True, j.get('data')))
+        return (True, j.get('data'))
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # runs a coroutine to completion on the client's loop from synchronous code (not from a coroutine
+    # already running on that loop, which would wait for itself)
+    #-
+    def run(self, coroutine):
+        loop = self.get_loop()
+        if (threading.current_thread().name == 'm2m loop'):
+            coroutine.close()
+            raise RuntimeError('m2m_client.run called from its own event loop; await the coroutine instead')
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    async def scene_search(self, d_post, **kwargs):
+        return await self.post('scene-search', d_post, **kwargs)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # runs on a worker thread of the client's loop; the semaphore keeps at most max_concurrency
+    # requests on the wire
+    #-
+    def send(self, url, data, header):
+        with self.semaphore:
+            return self.session.post(url, data, headers=header, timeout=self.timeout)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def set_session(self, session):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        session.mount('https://', adapter)
+        self.session = session
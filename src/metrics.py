@@ -0,0 +1,151 @@
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+#--------------------------------------------------------------------------------------------------
+#+
+# per-stage timers and counters (query, download, extract, read, decode, render...) with optional
+# tracemalloc peak memory and a cProfile capture switch. stages are free-form names; one shared
+# registry, stats, is used by every module.
+#-
+class metrics():
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __init__(self):
+        self.counter = {}
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.stage = {}
+        self.t0 = time.time()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __str__(self):
+        d = self.get()
+        s = [f'{"stage":<28}{"count":>8}{"total s":>10}{"mean ms":>10}{"max ms":>10}{"MB":>10}{"MB/s":>10}']
+        for name, st in sorted(d['stages'].items()):
+            s.append(f'{name:<28}{st["count"]:>8}{st["total"]:>10.2f}{1000*st["mean"]:>10.1f}'+
+                     f'{1000*st["max"]:>10.1f}{st["bytes"]/2**20:>10.1f}{st["rate"]/2**20:>10.1f}')
+        for name, n in sorted(d['counters'].items()):
+            s.append(f'{name:<28}{n:>8}')
+        if (d['memory'] != None):
+            s.append(f'memory: {d["memory"]["current"]/2**20:.1f} MB, peak {d["memory"]["peak"]/2**20:.1f} MB')
+        return '\n'.join(s)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # records one measurement of the stage (seconds and, for i/o stages, bytes moved)
+    #-
+    def add(self, stage, seconds, n_bytes=0):
+        with self.lock:
+            st = self.stage.setdefault(stage, {'bytes':0, 'count':0, 'max':0.0, 'min':None, 'total':0.0})
+            st['bytes'] += n_bytes
+            st['count'] += 1
+            st['max'] = max(st['max'], seconds)
+            st['min'] = seconds if (st['min'] == None) else min(st['min'], seconds)
+            st['total'] += seconds
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def count(self, name, n=1):
+        with self.lock:
+            self.counter[name] = self.counter.get(name, 0)+n
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get(self):
+        with self.lock:
+            stages = {}
+            for name, st in self.stage.items():
+                stages[name] = dict(st, mean=st['total']/st['count'],
+                                    rate=st['bytes']/st['total'] if (st['total'] > 0) else 0.0)
+            d = {'counters':dict(self.counter), 'stages':stages, 'uptime':time.time()-self.t0}
+        d['memory'] = None
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            d['memory'] = {'current':current, 'peak':peak}
+        return d
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def is_profiling(self):
+        return self.profiler != None
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def reset(self):
+        with self.lock:
+            self.counter.clear()
+            self.stage.clear()
+            self.t0 = time.time()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # tracemalloc slows allocations down, so memory tracing is off until asked for
+    #-
+    def set_memory_tracing(self, on=True):
+        if on and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not on and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # profiles the calling thread (cProfile does not follow other threads)
+    #-
+    def start_profile(self):
+        if (self.profiler == None):
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # stops the capture, optionally saving it for pstats/snakeviz, and returns the top entries
+    #-
+    def stop_profile(self, file=None, n=30):
+        if (self.profiler == None):
+            return ''
+        self.profiler.disable()
+        if (file != None):
+            self.profiler.dump_stats(file)
+        s = io.StringIO()
+        pstats.Stats(self.profiler, stream=s).sort_stats('cumulative').print_stats(n)
+        self.profiler = None
+        return s.getvalue()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    @contextmanager
+    def timer(self, stage, n_bytes=0):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter()-t0, n_bytes=n_bytes)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def to_json(self, file=None):
+        s = json.dumps(self.get(), indent=2)
+        if (file != None):
+            with open(file, 'w') as f:
+                f.write(s)
+        return s
+
+stats = metrics()
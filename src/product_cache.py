@@ -0,0 +1,101 @@
+import threading
+from collections import OrderedDict
+
+#--------------------------------------------------------------------------------------------------
+#+
+# least-recently-used cache of decoded products keyed by (path/row, date, product), bounded by the
+# total number of bytes held rather than the number of entries
+#-
+class product_cache():
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __init__(self, max_bytes=2*1024**3):
+        self.d = OrderedDict()
+        self.evictions = 0
+        self.hits = 0
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.misses = 0
+        self.n_bytes = 0
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.d
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __len__(self):
+        return len(self.d)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __str__(self):
+        return (f'product cache: {len(self.d)} items, {self.n_bytes/2**20:.1f}/{self.max_bytes/2**20:.1f} MB, '+
+                f'hits: {self.hits} misses: {self.misses} evictions: {self.evictions}')
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def clear(self):
+        with self.lock:
+            self.d.clear()
+            self.n_bytes = 0
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # removes the least recently used entries until the budget is met. the newest entry is always
+    # kept, so a single product larger than the budget is still usable
+    #-
+    def evict(self):
+        while (self.n_bytes > self.max_bytes) and (len(self.d) > 1):
+            _, value = self.d.popitem(last=False)
+            self.n_bytes -= value.nbytes
+            self.evictions += 1
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get(self, key):
+        with self.lock:
+            value = self.d.get(key)
+            if (value is None):
+                self.misses += 1
+                return None
+            self.d.move_to_end(key)
+            self.hits += 1
+            return value
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def put(self, key, value):
+        with self.lock:
+            if key in self.d:
+                self.n_bytes -= self.d.pop(key).nbytes
+            self.d[key] = value
+            self.n_bytes += value.nbytes
+            self.evict()
+        return value
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def set_budget(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.evict()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def stats(self):
+        with self.lock:
+            return {'bytes':self.n_bytes, 'evictions':self.evictions, 'hits':self.hits,
+                    'items':len(self.d), 'max_bytes':self.max_bytes, 'misses':self.misses}
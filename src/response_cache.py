@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+
+TTL = {'dataset-search':7*86400, 'download-options':3600, 'scene-search':86400} # seconds, by endpoint
+
+#--------------------------------------------------------------------------------------------------
+#+
+# local store of M2M responses, one json file per request keyed by the endpoint and a hash of the
+# normalized request body. entries expire after the endpoint's time to live, except in offline mode,
+# where every stored response is served and nothing goes to the network.
+#-
+class response_cache():
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __init__(self, folder=None, log=print, offline=False, ttl=None):
+        self.dir = os.path.join(Path.home(), 'methane_finder', 'm2m_cache') if (folder == None) else folder
+        if not os.path.exists(self.dir):
+            os.makedirs(self.dir)
+        self.hits = 0
+        self.log = log
+        self.misses = 0
+        self.offline = offline
+        self.ttl = dict(TTL) if (ttl == None) else ttl
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __str__(self):
+        return f'M2M cache: {self.dir} (hits: {self.hits} misses: {self.misses}{" offline" if self.offline else ""})'
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def clear(self):
+        for base in os.listdir(self.dir):
+            if (os.path.splitext(base)[1] == '.json'):
+                os.remove(os.path.join(self.dir, base))
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # returns the stored (void, data) response, or None if there is no fresh entry
+    #-
+    def get(self, ep, d_post):
+        if not self.is_cached(ep):
+            return None
+        file = self.get_file(ep, d_post)
+        if not os.path.exists(file):
+            self.misses += 1
+            return None
+        with open(file, 'r') as f:
+            j = json.load(f)
+        age = time.time()-j['time']
+        if (age > self.ttl[ep]) and not self.offline:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.log(f' cache hit: {ep} ({age/60:.0f} min old)')
+        return tuple(j['response'])
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_file(self, ep, d_post):
+        body = json.dumps(d_post, separators=(',',':'), sort_keys=True)
+        return os.path.join(self.dir, f'{ep}_{hashlib.sha256(body.encode()).hexdigest()[:32]}.json')
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def is_cached(self, ep):
+        return ep in self.ttl
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def put(self, ep, d_post, response):
+        if not self.is_cached(ep):
+            return None
+        file = self.get_file(ep, d_post)
+    # a temporary file of its own, as the client's threads may store the same request at once
+        fd, tmp = tempfile.mkstemp(dir=self.dir, prefix=os.path.basename(file)+'.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'endpoint':ep, 'request':d_post, 'response':list(response), 'time':time.time()}, f)
+            os.replace(tmp, file)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
@@ -0,0 +1,139 @@
+import numpy as np
+from PyQt6 import QtCore, QtGui, QtWidgets
+
+MARGIN = 40 # pixels around the plot area for the axis labels
+
+#--------------------------------------------------------------------------------------------------
+#+
+# line plot of one pixel-drill series (data_manager.pixel_series) against date, drawn with
+# QPainter so no plotting package is needed. missing dates (NaN) are left out of the line.
+#-
+class time_series_view(QtWidgets.QWidget):
+    signal_date_selected = QtCore.pyqtSignal(str)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def __init__(self, parent=None, key='methane'):
+        super().__init__(parent)
+        self.key = key
+        self.series = None
+        self.setMinimumHeight(160)
+        self.setMouseTracking(True)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def clear(self):
+        self.series = None
+        self.update()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # the plotted points as (x, y) widget coordinates, one per date (NaN for missing values)
+    #-
+    def get_points(self):
+        v = self.series[self.key]
+        w, h = self.width()-2*MARGIN, self.height()-2*MARGIN
+        x = MARGIN+w*np.arange(len(v))/max(1, len(v)-1)
+        vmin, vmax = self.get_range()
+        y = MARGIN+h*(vmax-v)/(vmax-vmin)
+        return x, y
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_range(self):
+        v = self.series[self.key]
+        v = v[np.isfinite(v)]
+        if (len(v) == 0):
+            return 0.0, 1.0
+        vmin, vmax = float(v.min()), float(v.max())
+        return (vmin-0.5, vmax+0.5) if (vmax == vmin) else (vmin, vmax)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    # nearest date to the mouse; clicking it lets the viewer open that date
+    #-
+    def mousePressEvent(self, event):
+        i = self.get_index(event.position().x())
+        if (i != None):
+            self.signal_date_selected.emit(self.series['dt'][i])
+        super().mousePressEvent(event)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def mouseMoveEvent(self, event):
+        i = self.get_index(event.position().x())
+        if (i != None):
+            v = self.series[self.key][i]
+            self.setToolTip(f'{self.series["date"][i]}: {v:.1f}')
+        super().mouseMoveEvent(event)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def get_index(self, x):
+        if (self.series == None) or (len(self.series['dt']) == 0):
+            return None
+        xs, ys = self.get_points()
+        return int(np.argmin(np.abs(xs-x)))
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.RenderHint.Antialiasing)
+        painter.fillRect(self.rect(), QtGui.QColor(30, 30, 30))
+        painter.setPen(QtGui.QColor(200, 200, 200))
+        if (self.series == None) or (len(self.series['dt']) == 0):
+            painter.drawText(self.rect(), QtCore.Qt.AlignmentFlag.AlignCenter, 'click the image for a time series')
+            return None
+    # axes and labels
+        rect = QtCore.QRectF(MARGIN, MARGIN, self.width()-2*MARGIN, self.height()-2*MARGIN)
+        painter.drawRect(rect)
+        vmin, vmax = self.get_range()
+        lon, lat = self.series['lonlat']
+        painter.drawText(MARGIN, MARGIN-8, f'{self.key} at [{lon:.3f},{lat:.3f}] ({self.series["pr"]})')
+        painter.drawText(2, MARGIN+10, f'{vmax:.0f}')
+        painter.drawText(2, int(rect.bottom()), f'{vmin:.0f}')
+        painter.drawText(MARGIN, int(rect.bottom())+16, self.series['date'][0])
+        painter.drawText(QtCore.QRectF(rect.right()-100, rect.bottom()+4, 100, 16),
+                         QtCore.Qt.AlignmentFlag.AlignRight, self.series['date'][-1])
+    # the series, broken where a date has no value
+        x, y = self.get_points()
+        painter.setPen(QtGui.QPen(QtGui.QColor(255, 160, 40), 1.5))
+        path = QtGui.QPainterPath()
+        pen_down = False
+        for xi, yi in zip(x, y):
+            if not np.isfinite(yi):
+                pen_down = False
+                continue
+            if pen_down:
+                path.lineTo(xi, yi)
+            else:
+                path.moveTo(xi, yi)
+            pen_down = True
+            painter.drawEllipse(QtCore.QPointF(xi, yi), 2.5, 2.5)
+        painter.drawPath(path)
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def set_key(self, key):
+    # the series to plot: 'methane' or one of the drilled bands
+        if (self.series != None) and (key not in self.series):
+            return None
+        self.key = key
+        self.update()
+
+    #----------------------------------------------------------------------------------------------
+    #+
+    #-
+    def set_series(self, series):
+        self.series = series
+        if (self.key not in series):
+            self.key = next(key for key in series if isinstance(series[key], np.ndarray))
+        self.update()
@@ -0,0 +1,48 @@
+import json
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('osgeo')
+pytest.importorskip('requests')
+import batch
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+def get_job(**kwargs):
+    job = {'name':'test', 'working_folder':'/data/landsat', 'output_folder':'/data/products',
+           'start':'2024-01-01', 'end':'2024-01-31', 'products':['rgb','methane','anomaly'],
+           'formats':['tif','png'], 'points':[[54.199,38.499]]}
+    job.update(kwargs)
+    return job
+
+def test_valid_job():
+    batch.check_job(get_job())
+    batch.check_job(get_job(points=None, boxes=[[-104.0,31.5,-103.0,32.5]], products=['RGB']))
+
+@pytest.mark.parametrize('kwargs, match', [
+    ({'end':''}, 'missing end'),
+    ({'working_folder':None, 'output_folder':None}, 'missing output_folder, working_folder'),
+    ({'products':['rgb','ndvi']}, 'unknown products ndvi'),
+    ({'formats':['jpg']}, 'unknown formats jpg'),
+    ({'points':[]}, 'no points or boxes'),
+])
+def test_invalid_job(kwargs, match):
+    with pytest.raises(ValueError, match=match):
+        batch.check_job(get_job(**kwargs))
+
+def test_load_job_defaults(tmp_path):
+    file = tmp_path/'jobs.json'
+    file.write_text(json.dumps({'working_folder':'/w', 'output_folder':'/o', 'start':'2024-01-01',
+                                'end':'2024-01-31', 'jobs':[{'points':[[1.0,2.0]]},
+                                                            {'name':'late', 'boxes':[[0,0,1,1]], 'end':'2024-02-29'}]}))
+    jobs = batch.load_job(str(file))
+    assert [job['name'] for job in jobs] == ['job0', 'late']
+    assert (jobs[0]['cloud_cover'], jobs[0]['formats'], jobs[0]['products']) == (50.0, ['tif'], ['rgb','methane'])
+    assert (jobs[0]['end'], jobs[1]['end']) == ('2024-01-31', '2024-02-29')
+
+def test_load_job_rejects_before_running(tmp_path):
+    file = tmp_path/'jobs.json'
+    file.write_text(json.dumps({'jobs':[{'points':[[1.0,2.0]], 'start':'2024-01-01'}]}))
+    with pytest.raises(ValueError, match='missing end, output_folder, working_folder'):
+        batch.load_job(str(file))
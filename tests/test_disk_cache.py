@@ -0,0 +1,76 @@
+import os
+import pytest
+
+np = pytest.importorskip('numpy')
+from disk_cache import disk_cache
+
+#--------------------------------------------------------------------------------------------------
+#+
+# a <path/row>/<date> scene folder with placeholder band files
+#-
+def make_scene(dir, pr='123034', dt='20240101', bands=['B4','B3','B2','B6','B7']):
+    folder = os.path.join(dir, pr, dt)
+    os.makedirs(folder, exist_ok=True)
+    dDT = {}
+    for band in bands:
+        dDT[band] = os.path.join(folder, f'{band}.TIF')
+        with open(dDT[band], 'wb') as f:
+            f.write(band.encode())
+    return dDT
+
+def test_put_get(tmp_path):
+    cache = disk_cache(str(tmp_path))
+    dDT = make_scene(str(tmp_path))
+    data = np.arange(12, dtype=np.uint16).reshape(3, 4)
+    cache.put(dDT, 'methane', data)
+    assert cache.has(dDT, 'methane')
+    assert np.array_equal(cache.get(dDT, 'methane'), data)
+    assert cache.get(dDT, 'rgb') is None
+
+def test_changed_band_invalidates(tmp_path):
+    cache = disk_cache(str(tmp_path))
+    dDT = make_scene(str(tmp_path))
+    cache.put(dDT, 'methane', np.zeros((2, 2), dtype=np.uint16))
+    st = os.stat(dDT['B7'])
+    os.utime(dDT['B7'], ns=(st.st_atime_ns, st.st_mtime_ns+10**9))
+    assert cache.get(dDT, 'methane') is None
+    cache.put(dDT, 'methane', np.ones((2, 2), dtype=np.uint16))
+    assert len(cache.get_files()) == 1 # the stale entry was replaced
+
+def test_other_bands_do_not_invalidate(tmp_path):
+    cache = disk_cache(str(tmp_path))
+    dDT = make_scene(str(tmp_path))
+    cache.put(dDT, 'rgb', np.zeros((2, 2, 3), dtype=np.uint8))
+    st = os.stat(dDT['B6'])
+    os.utime(dDT['B6'], ns=(st.st_atime_ns, st.st_mtime_ns+10**9))
+    assert cache.get(dDT, 'rgb') is not None
+
+def test_anomaly_depends_on_stack(tmp_path):
+    cache = disk_cache(str(tmp_path))
+    dDT = make_scene(str(tmp_path))
+    dDT['stack'] = os.path.join(str(tmp_path), 'stack_a.tif')
+    with open(dDT['stack'], 'wb') as f:
+        f.write(b'a')
+    cache.put(dDT, 'anomaly', np.zeros((2, 2), dtype=np.uint16))
+    assert cache.get(dDT, 'anomaly') is not None
+    assert cache.get(dict(dDT, stack=dDT['B6']), 'anomaly') is None
+
+def test_enforce_limit_removes_oldest(tmp_path):
+    dDT = [make_scene(str(tmp_path), dt=dt) for dt in ['20240101','20240102','20240103']]
+    data = np.zeros(1000, dtype=np.uint8)
+    cache = disk_cache(str(tmp_path), max_bytes=10**6)
+    for i, d in enumerate(dDT):
+        file = cache.put(d, 'methane', data)
+        os.utime(file, (i, i))
+    cache.max_bytes = 2*os.path.getsize(file)
+    cache.enforce_limit()
+    assert not cache.has(dDT[0], 'methane')
+    assert cache.has(dDT[1], 'methane') and cache.has(dDT[2], 'methane')
+
+def test_clear_and_remove(tmp_path):
+    cache = disk_cache(str(tmp_path))
+    dDT = make_scene(str(tmp_path))
+    cache.put(dDT, 'methane', np.zeros((2, 2), dtype=np.uint16))
+    cache.clear()
+    assert (cache.get_files() == []) and (cache.get_size() == 0)
+    assert cache.remove(os.path.join(str(tmp_path), 'missing.npy')) # already gone counts as removed
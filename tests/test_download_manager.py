@@ -0,0 +1,174 @@
+import io
+import json
+import os
+import pytest
+import tarfile
+
+requests = pytest.importorskip('requests')
+from download_manager import download_manager, get_offset
+
+DATA = bytes(range(256))*40
+URL = 'https://example.com/download?product_id=abc123&x=1'
+
+#--------------------------------------------------------------------------------------------------
+#+
+# response of the fake session: serves DATA, honouring Range unless told otherwise
+#-
+class response():
+
+    def __init__(self, data, headers, status_code):
+        self.data = data
+        self.headers = headers
+        self.raw = io.BytesIO(data)
+        self.status_code = status_code
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i+chunk_size]
+
+    def raise_for_status(self):
+        if (self.status_code >= 400) and (self.status_code != 416):
+            raise requests.HTTPError(response=self)
+
+#--------------------------------------------------------------------------------------------------
+#+
+#-
+class session():
+
+    def __init__(self, data=DATA, ranges=True, fail_after=None):
+        self.data = data
+        self.fail_after = fail_after
+        self.ranges = ranges
+        self.requests = []
+
+    def get(self, url, headers={}, stream=True, timeout=None):
+        self.requests.append(dict(headers))
+        offset = 0
+        if ('Range' in headers) and self.ranges:
+            offset = int(headers['Range'][len('bytes='):-1])
+            if (offset >= len(self.data)):
+                return response(b'', {}, 416)
+        data = self.data[offset:]
+        headers = {'Content-Length':str(len(data)), 'Content-Disposition':'attachment; filename="scene.tar"'}
+        if (self.fail_after != None): # a dropped connection: fewer bytes than announced
+            data, self.fail_after = data[:self.fail_after], None
+        return response(data, headers, 206 if (offset > 0) else 200)
+
+def get_manager(s):
+    return download_manager(backoff=0.0, chunk_size=100, log=lambda *args: None, session=s)
+
+def test_download(tmp_path):
+    s = session()
+    file = get_manager(s).download(URL, str(tmp_path))
+    assert os.path.basename(file) == 'scene.tar'
+    assert open(file, 'rb').read() == DATA
+    assert not os.path.exists(os.path.join(str(tmp_path), 'abc123.part'))
+
+def test_resume_with_range(tmp_path):
+    with open(os.path.join(str(tmp_path), 'abc123.part'), 'wb') as f:
+        f.write(DATA[:1000])
+    s = session()
+    file = get_manager(s).download(URL, str(tmp_path))
+    assert s.requests[0]['Range'] == 'bytes=1000-'
+    assert open(file, 'rb').read() == DATA
+
+def test_range_ignored_starts_over(tmp_path):
+    with open(os.path.join(str(tmp_path), 'abc123.part'), 'wb') as f:
+        f.write(b'x'*1000)
+    s = session(ranges=False)
+    file = get_manager(s).download(URL, str(tmp_path))
+    assert open(file, 'rb').read() == DATA
+
+def test_part_past_end_starts_over(tmp_path):
+    with open(os.path.join(str(tmp_path), 'abc123.part'), 'wb') as f:
+        f.write(b'x'*(len(DATA)+10))
+    s = session()
+    file = get_manager(s).download(URL, str(tmp_path))
+    assert 'Range' not in s.requests[-1]
+    assert open(file, 'rb').read() == DATA
+
+def test_dropped_transfer_resumes(tmp_path):
+    s = session(fail_after=3000)
+    file = get_manager(s).download(URL, str(tmp_path))
+    assert s.requests[1]['Range'] == 'bytes=3000-'
+    assert open(file, 'rb').read() == DATA
+
+def test_client_error_is_not_retried(tmp_path):
+    class forbidden(session):
+        def get(self, url, headers={}, stream=True, timeout=None):
+            self.requests.append(dict(headers))
+            return response(b'', {}, 403)
+    s = forbidden()
+    with pytest.raises(requests.HTTPError):
+        get_manager(s).download(URL, str(tmp_path))
+    assert len(s.requests) == 1
+
+def test_get_offset(tmp_path):
+    part = os.path.join(str(tmp_path), 'a.part')
+    assert get_offset(part) == 0
+    with open(part, 'wb') as f:
+        f.write(b'x'*100)
+    assert (get_offset(part), get_offset(part, streamed=True)) == (100, 0)
+
+#--------------------------------------------------------------------------------------------------
+#+
+# streamed bundles
+#-
+def make_bundle(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+MEMBERS = [('LC09_B6.TIF', b'6'*3000), ('LC09_MTL.txt', b'm'*700), ('LC09_B7.TIF', b'7'*5000)]
+
+def is_band(name):
+    return name.endswith('.TIF')
+
+def test_stream(tmp_path):
+    s = session(data=make_bundle(MEMBERS))
+    folder = get_manager(s).download(URL, str(tmp_path), extract=is_band)
+    assert sorted(os.listdir(folder)) == ['LC09_B6.TIF', 'LC09_B7.TIF']
+    assert open(os.path.join(folder, 'LC09_B7.TIF'), 'rb').read() == b'7'*5000
+
+def test_stream_skips_paths_outside_folder(tmp_path):
+    folder = os.path.join(str(tmp_path), 'scene')
+    os.makedirs(folder)
+    s = session(data=make_bundle([('../evil.TIF', b'x'), ('/abs.TIF', b'x'), ('ok.TIF', b'y')]))
+    get_manager(s).download(URL, folder, extract=is_band)
+    assert sorted(os.listdir(str(tmp_path))) == ['scene']
+    assert os.listdir(folder) == ['ok.TIF']
+
+def test_stream_resumes_after_last_member(tmp_path):
+    data = make_bundle(MEMBERS)
+    s = session(data=data)
+    manager = get_manager(s)
+    manager.download(URL, str(tmp_path), extract=is_band)
+    end = 3*tarfile.BLOCKSIZE+3072+1024+5120 # headers and padded data of the three members
+    with open(os.path.join(str(tmp_path), 'abc123.part'), 'w') as f:
+        json.dump({'mode':'stream', 'offset':end}, f)
+    assert manager.download(URL, str(tmp_path), extract=is_band) == str(tmp_path)
+    assert s.requests[-1]['Range'] == f'bytes={end}-'
+    assert not os.path.exists(os.path.join(str(tmp_path), 'abc123.part'))
+
+def test_dropped_stream_resumes(tmp_path):
+    s = session(data=make_bundle(MEMBERS), fail_after=6000)
+    folder = get_manager(s).download(URL, str(tmp_path), extract=is_band)
+    assert 'Range' in s.requests[1]
+    assert sorted(os.listdir(folder)) == ['LC09_B6.TIF', 'LC09_B7.TIF'] # no .tmp left behind
+    assert open(os.path.join(folder, 'LC09_B7.TIF'), 'rb').read() == b'7'*5000
+
+def test_get_offset_stream_state(tmp_path):
+    part = os.path.join(str(tmp_path), 'a.part')
+    with open(part, 'w') as f:
+        json.dump({'mode':'stream', 'offset':2048}, f)
+    assert (get_offset(part), get_offset(part, streamed=True)) == (0, 2048)
@@ -0,0 +1,61 @@
+import threading
+from download_scheduler import download_scheduler
+
+#--------------------------------------------------------------------------------------------------
+#+
+# M2M client stand-in: download-retrieve lists the ids in ready as available
+#-
+class client():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = set()
+
+    def post(self, ep, d_post):
+        return ep, d_post
+
+    def run(self, request):
+        with self.lock:
+            return True, {'available':[{'downloadId':i, 'url':f'u{i}'} for i in sorted(self.ready)]}
+
+def get_scheduler(c, received, events, timeout=60.0):
+    s = download_scheduler(c, received.append, interval=0.01, log=lambda *args: None, max_interval=0.02,
+                           timeout=timeout)
+    s.add_listener(lambda event, d: events.append(event))
+    return s
+
+def test_hands_over_ready_downloads():
+    c, received, events = client(), [], []
+    s = get_scheduler(c, received, events)
+    c.ready = {1, 2}
+    s.add('job', [{'downloadId':1}, {'downloadId':2}])
+    s.wait()
+    assert sorted(d['downloadId'] for d in received) == [1, 2]
+    assert (events.count('ready'), events[-1], str(s)) == (2, 'done', 'prepared downloads: 2/2 ready')
+
+def test_timeout_drops_pending():
+    c, received, events = client(), [], []
+    s = get_scheduler(c, received, events, timeout=0.05)
+    s.add('job', [{'downloadId':1}])
+    s.wait()
+    assert (events, s.jobs, s.n_total) == (['timeout'], {}, 0)
+
+def test_cancel_drops_pending():
+    c, received, events = client(), [], []
+    s = get_scheduler(c, received, events)
+    s.add('job', [{'downloadId':1}])
+    s.cancel()
+    s.wait()
+    assert (s.jobs, received, s.is_busy()) == ({}, [], False)
+
+def test_add_after_cancel_polls_again():
+    c, received, events = client(), [], []
+    s = get_scheduler(c, received, events)
+    s.add('old', [{'downloadId':1}])
+    s.cancel()
+    cancelled = s.stop
+    c.ready = {1, 2}
+    s.add('new', [{'downloadId':2}])
+    s.wait()
+    assert cancelled.is_set() # a new poller does not undo the cancel of the old one
+    assert [d['downloadId'] for d in received] == [2]
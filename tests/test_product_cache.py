@@ -0,0 +1,54 @@
+from product_cache import product_cache
+
+#--------------------------------------------------------------------------------------------------
+#+
+# stands in for a decoded product; the cache only reads nbytes
+#-
+class item():
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+def test_get_put():
+    cache = product_cache(max_bytes=100)
+    value = cache.put(('p', 'd', 'rgb'), item(10))
+    assert cache.get(('p', 'd', 'rgb')) is value
+    assert cache.get(('p', 'd', 'methane')) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_evicts_least_recently_used():
+    cache = product_cache(max_bytes=30)
+    for key in ['a','b','c']:
+        cache.put(key, item(10))
+    cache.get('a') # b is now the oldest
+    cache.put('d', item(10))
+    assert 'b' not in cache
+    assert all(key in cache for key in ['a','c','d'])
+    assert (cache.n_bytes, cache.evictions) == (30, 1)
+
+def test_keeps_an_entry_over_budget():
+    cache = product_cache(max_bytes=10)
+    cache.put('a', item(5))
+    cache.put('b', item(50))
+    assert ('b' in cache) and ('a' not in cache)
+    assert cache.n_bytes == 50
+
+def test_replace_counts_bytes_once():
+    cache = product_cache(max_bytes=100)
+    cache.put('a', item(40))
+    cache.put('a', item(20))
+    assert (len(cache), cache.n_bytes) == (1, 20)
+
+def test_set_budget_evicts():
+    cache = product_cache(max_bytes=100)
+    for key in ['a','b','c']:
+        cache.put(key, item(30))
+    cache.set_budget(40)
+    assert list(cache.d) == ['c']
+    assert cache.stats()['bytes'] == 30
+
+def test_clear():
+    cache = product_cache()
+    cache.put('a', item(30))
+    cache.clear()
+    assert (len(cache), cache.n_bytes) == (0, 0)